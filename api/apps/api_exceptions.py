@@ -8,6 +8,6 @@ class CustomApiException(APIException):
     default_code = 'error'
 
     def __init__(self, detail=None, code=None, status_code=None):
-        if status_code is None:
+        if status_code is not None:
             self.status_code = status_code
         super().__init__(detail, code)
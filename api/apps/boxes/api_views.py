@@ -1,30 +1,45 @@
+import errno
+import hashlib
 import logging
-from collections import namedtuple
+from calendar import timegm
+from collections import OrderedDict, namedtuple
+from functools import reduce
+from operator import or_
 
 import re
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db.models import OuterRef, Q, Subquery, Sum
 from django.db.utils import IntegrityError
 from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from rest_framework import status
 from rest_framework import viewsets
 from rest_framework.exceptions import ValidationError, ParseError, APIException
 from rest_framework.generics import get_object_or_404
 from rest_framework.mixins import (
     RetrieveModelMixin, DestroyModelMixin, ListModelMixin)
-from rest_framework.parsers import FileUploadParser
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
 from apps.api_exceptions import CustomApiException
-from apps.boxes.models import Box, BoxUpload, BoxVersion, BoxProvider
+from apps.boxes.models import (
+    Box, BoxDailyPulls, BoxMember, BoxMetadata, BoxUpload, BoxVersion,
+    BoxProvider, get_version_constraint_q)
+from apps.boxes.metadata import (
+    complete_boxes_metadata, complete_metadata, create_metadata)
+from apps.boxes.parsers import BoxUploadParser
 from apps.boxes.permissions import (
     BoxPermissions, BaseBoxPermissions, BoxMemberPermissions,
     BoxProviderPermissions, BoxVersionPermissions,
     IsStaffOrRequestedUserPermissions, BoxUploadPermissions)
 from apps.boxes.serializers import (
     BoxSerializer, BoxUploadSerializer, BoxMetadataSerializer,
-    BoxVersionSerializer, BoxProviderSerializer, BoxMemberSerializer)
+    BoxVersionSerializer, BoxProviderSerializer, BoxMemberSerializer,
+    BoxPullsSerializer, BoxResolveSerializer)
+from apps.boxes.utils import get_free_space
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +47,30 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 
+def make_etag(request, *parts):
+    """ Returns strong ETag of a response, which is defined by `parts`.
+
+    Responses include absolute URLs, so they differ between hosts.
+    """
+    value = ':'.join(str(part) for part in
+                     (request.build_absolute_uri('/'), ) + parts)
+    return quote_etag(hashlib.md5(value.encode()).hexdigest())
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    """ Returns 304 response, when the client has the current
+    representation, otherwise one returned by `get_response`.
+    """
+    last_modified = timegm(last_modified.utctimetuple())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_response()
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
 class UserBoxMixin:
     box_permission_classes = (BaseBoxPermissions, )
 
@@ -72,16 +111,55 @@ class UserBoxMixin:
 
         return obj
 
+    def get_box_related_object(self, queryset, box_lookup, first=False,
+                               **filters):
+        """ Returns object of `queryset`, which belongs to requested box,
+        or the first one of them in order of `queryset`, when `first`.
+
+        Object is fetched along with the box, its owner and membership
+        of request user in a single query, so permissions are checked
+        without further queries. Empty `box_lookup` means `queryset`
+        is of boxes.
+        """
+        user = self.request.user
+        prefix = box_lookup + '__' if box_lookup else ''
+        queryset = queryset.select_related(prefix + 'owner').filter(
+            **{prefix + 'owner__username': self.kwargs['username'],
+               prefix + 'name': self.kwargs['box_name']},
+            **filters
+        )
+        if user.is_authenticated:
+            queryset = queryset.annotate(member_permissions=Subquery(
+                BoxMember.objects
+                .filter(box=OuterRef(box_lookup or 'pk'), user=user)
+                .values('permissions')[:1]
+            ))
+        if first:
+            queryset = queryset[:1]
+        obj = get_object_or_404(queryset)
+
+        box = obj
+        for field in filter(None, box_lookup.split('__')):
+            box = getattr(box, field)
+        if user.is_authenticated:
+            box.set_member_permissions(user, obj.member_permissions)
+
+        # May raise a permission denied
+        self.check_box_object_permissions(self.request, box)
+
+        return obj
+
     def get_box_version_object(self):
-        return get_object_or_404(
-            self.get_box_object().versions.all(),
-            **{'version': self.kwargs['version']}
+        return self.get_box_related_object(
+            BoxVersion.objects.all(), 'box',
+            version=self.kwargs['version'],
         )
 
     def get_box_provider_object(self):
-        return get_object_or_404(
-            self.get_box_version_object().providers.all(),
-            **{'provider': self.kwargs['provider']}
+        return self.get_box_related_object(
+            BoxProvider.objects.all(), 'version__box',
+            version__version=self.kwargs['version'],
+            provider=self.kwargs['provider'],
         )
 
     def get_box_queryset(self):
@@ -126,6 +204,17 @@ class UserBoxViewSet(UserBoxMixin, viewsets.ModelViewSet):
     def get_object(self):
         return self.get_box_object()
 
+    def retrieve(self, request, *args, **kwargs):
+        box = self.get_box_related_object(Box.objects.annotate_pulls(), '')
+        last_modified = max(box.date_modified, box.date_updated)
+        # Pulls and permissions of the user aren't
+        # reflected by modification dates of the box
+        etag = make_etag(request, last_modified.isoformat(), box.pulls,
+                         request.user.pk, box.get_perms_for_user(request.user))
+        return conditional_response(
+            request, etag, last_modified,
+            lambda: Response(self.get_serializer(box).data))
+
     def perform_create(self, serializer):
         user = self.get_user_object()
         try:
@@ -179,7 +268,7 @@ class BoxVersionViewSet(UserBoxMixin, viewsets.ModelViewSet):
     search_fields = ('version', '=providers__provider', )
 
     def get_queryset(self):
-        return self.get_box_object().versions.all().order_by('-date_updated')
+        return self.get_box_object().versions.order_by_version()
 
     def perform_create(self, serializer):
         box = self.get_box_object()
@@ -194,6 +283,37 @@ class BoxVersionViewSet(UserBoxMixin, viewsets.ModelViewSet):
             })
 
 
+class BoxResolveViewSet(UserBoxMixin, GenericViewSet):
+    """ Latest version of a box satisfying Vagrant version `constraint`
+    with one of its providers, e.g. `?constraint=>= 2.1, < 3.0`.
+
+    Provider may be chosen by `provider` parameter.
+    """
+    permission_classes = (BoxVersionPermissions, )
+    queryset = BoxProvider.objects.none()
+    serializer_class = BoxResolveSerializer
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = BoxProvider.objects.filled_in().order_by(
+            '-version__version_major', '-version__version_minor',
+            '-version__version_patch', '-version__version', 'provider')
+
+        constraint = request.query_params.get('constraint')
+        if constraint:
+            try:
+                queryset = queryset.filter(
+                    get_version_constraint_q(constraint, 'version__'))
+            except ValueError as e:
+                raise ValidationError({'constraint': str(e)})
+        provider = request.query_params.get('provider')
+        if provider:
+            queryset = queryset.filter(provider=provider)
+
+        provider = self.get_box_related_object(
+            queryset, 'version__box', first=True)
+        return Response(self.get_serializer(provider).data)
+
+
 class BoxProviderViewSet(UserBoxMixin, viewsets.ModelViewSet):
     permission_classes = (BoxProviderPermissions, )
     queryset = BoxProvider.objects.none()
@@ -207,6 +327,12 @@ class BoxProviderViewSet(UserBoxMixin, viewsets.ModelViewSet):
         return self.get_box_version_object().providers.all()\
             .order_by('-date_updated')
 
+    def get_object(self):
+        provider = self.get_box_provider_object()
+        # May raise a permission denied
+        self.check_object_permissions(self.request, provider)
+        return provider
+
     def perform_create(self, serializer):
         version = self.get_box_version_object()
         try:
@@ -223,6 +349,126 @@ class BoxProviderViewSet(UserBoxMixin, viewsets.ModelViewSet):
 class BoxMetadataViewSet(UserBoxViewSet):
     serializer_class = BoxMetadataSerializer
 
+    def retrieve(self, request, *args, **kwargs):
+        if {'limit', 'newer_than'} & set(request.query_params):
+            return self.retrieve_versions(request)
+
+        try:
+            metadata = self.get_box_related_object(
+                BoxMetadata.objects.all(), 'box')
+        except Http404:
+            # Metadata document is built, when it's requested first time
+            metadata = create_metadata(self.get_box_object())
+
+        def get_response():
+            return Response(
+                complete_metadata(metadata, request.build_absolute_uri))
+
+        if settings.SECURE_DOWNLOADS_SECRET:
+            # Signed download URLs differ in every response
+            return get_response()
+        etag = make_etag(request, metadata.date_updated.isoformat())
+        return conditional_response(
+            request, etag, metadata.date_updated, get_response)
+
+    def retrieve_versions(self, request):
+        """ Metadata of `limit` latest versions of the box, or of ones
+        newer than `newer_than` version, built from the database.
+        """
+        box = self.get_box_related_object(Box.objects.all(), '')
+        versions = BoxVersion.objects.filter(box=box)
+
+        newer_than = request.query_params.get('newer_than')
+        if newer_than:
+            try:
+                versions = versions.newer_than(newer_than)
+            except ValueError as e:
+                raise ValidationError({'newer_than': str(e)})
+
+        versions = (versions
+                    .order_by_version()
+                    .select_related('box__owner')
+                    .prefetch_related('providers'))
+        limit = request.query_params.get('limit')
+        if limit:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit <= 0:
+                raise ValidationError(
+                    {'limit': 'Ensure this value is a positive integer.'})
+            versions = versions[:limit]
+
+        context = self.get_serializer_context()
+        context['versions'] = versions
+        return Response(BoxMetadataSerializer(box, context=context).data)
+
+
+class BoxMetadataBulkViewSet(GenericViewSet):
+    """ Metadata of many boxes, which tags are listed in `boxes` query
+    parameter, e.g. `?boxes=alice/ubuntu,bob/centos`.
+
+    Metadata of boxes, which don't exist or aren't visible to the user,
+    is null. Number of queries doesn't depend on number of boxes.
+    """
+    permission_classes = (BoxPermissions, )
+    queryset = Box.objects.none()
+    max_boxes = 100
+
+    def list(self, request, *args, **kwargs):
+        tags = [tag for tag in request.query_params.get('boxes', '').split(',')
+                if tag]
+        if len(tags) > self.max_boxes:
+            raise ValidationError({
+                'boxes': 'Ensure this field has no more than {} boxes.'
+                         .format(self.max_boxes)
+            })
+
+        data = OrderedDict((tag, None) for tag in tags)
+        lookups = [
+            Q(owner__username=username, name=box_name)
+            for username, box_name in (
+                tag.split('/') for tag in data if tag.count('/') == 1)
+        ]
+        if not lookups:
+            return Response(data)
+
+        boxes = list(
+            Box.objects
+            .for_user(request.user)
+            .select_related('owner', 'metadata')
+            .filter(reduce(or_, lookups))
+        )
+        metadata = complete_boxes_metadata(boxes, request.build_absolute_uri)
+        for box in boxes:
+            data['{}/{}'.format(box.owner.username, box.name)] = \
+                metadata[box.pk]
+        return Response(data)
+
+
+class BoxPullsViewSet(UserBoxMixin, ListModelMixin, GenericViewSet):
+    """ Daily pulls of a box, or of its version, when it's specified.
+
+    Pulls appear here, once they are rolled up by `rollup_pulls` command.
+    """
+    permission_classes = (BoxPermissions, )
+    queryset = BoxDailyPulls.objects.none()
+    serializer_class = BoxPullsSerializer
+    ordering_fields = ('date', )
+    search_fields = ()
+
+    def get_queryset(self):
+        if 'version' in self.kwargs:
+            daily_pulls = BoxDailyPulls.objects.filter(
+                provider__version=self.get_box_version_object())
+        else:
+            daily_pulls = BoxDailyPulls.objects.filter(
+                provider__version__box=self.get_box_object())
+        return daily_pulls.values('date')\
+            .annotate(pulls=Sum('pulls'))\
+            .order_by('-date')
+
 
 class BoxUploadViewSet(UserBoxMixin, viewsets.ModelViewSet):
     permission_classes = (BoxUploadPermissions, )
@@ -233,6 +479,7 @@ class BoxUploadViewSet(UserBoxMixin, viewsets.ModelViewSet):
 
     def get_queryset(self):
         return self.get_box_provider_object().uploads.all()\
+            .prefetch_related('parts')\
             .order_by('-date_modified')
 
     def perform_create(self, serializer):
@@ -251,12 +498,63 @@ class BoxUploadViewSet(UserBoxMixin, viewsets.ModelViewSet):
             })
         logger.info('New upload initiated: {}'.format(upload))
 
+        source = self.get_mount_source(upload)
+        if source:
+            upload.mount(source)
+            return
+
+        self.reserve_space(upload)
+        if settings.BOX_UPLOAD_PREALLOCATE:
+            self.preallocate(upload)
+
+    def reject_upload(self, upload):
+        upload.delete()
+        logger.warning('No disk space for upload {}'.format(upload))
+        raise CustomApiException(
+            detail="Not enough disk space to store the box.",
+            status_code=status.HTTP_507_INSUFFICIENT_STORAGE,
+        )
 
-class BoxUploadParser(FileUploadParser):
-    media_type = 'application/octet-stream'
+    def reserve_space(self, upload):
+        """ Rejects upload, which doesn't fit into free disk space.
 
-    def get_filename(self, stream, media_type, parser_context):
-        return 'vagrant.box'
+        Space is reserved by the saved upload itself, so concurrent
+        uploads see each other and can't be admitted both, when
+        only one of them fits. Reservation is released, once upload
+        is completed, expires or is deleted.
+        """
+        free_space = get_free_space(settings.PROTECTED_MEDIA_ROOT)
+        if BoxUpload.objects.active().reserved_space() > free_space:
+            self.reject_upload(upload)
+
+    def preallocate(self, upload):
+        try:
+            upload.preallocate()
+        except OSError as e:
+            if e.errno != errno.ENOSPC:
+                upload.delete()
+                raise
+            self.reject_upload(upload)
+
+    def get_mount_source(self, upload):
+        """ Returns provider with the same file, which user can pull.
+
+        Providers have digests of their files with every checksum type,
+        so the one declared for the upload is matched, whichever type
+        providers were declared with.
+        """
+        readable_boxes = Box.objects.for_user(self.request.user)
+        checksum_field = 'checksum_' + upload.checksum_type
+        sources = (BoxProvider.objects
+                   .filled_in()
+                   .filter(file_size=upload.file_size,
+                           version__box__in=readable_boxes,
+                           **{checksum_field: upload.checksum})
+                   .exclude(pk=upload.provider_id))
+        for source in sources:
+            if source.file and source.file.storage.exists(source.file.name):
+                return source
+        return None
 
 
 class BoxUploadHandlerViewSet(UserBoxMixin, RetrieveModelMixin,
@@ -317,18 +615,17 @@ class BoxUploadHandlerViewSet(UserBoxMixin, RetrieveModelMixin,
                 "Complete length ({}) specified in header doesn't match "
                 "file size ({}) specified when upload was initiated."
                 .format(crange.total, box_upload.file_size))
-        # Range is zero-indexed
-        if crange.end > crange.total:
+        # Last byte position is inclusive according to RFC 7233
+        if crange.end >= crange.total:
             return self._get_range_not_satisfiable_response(
-                'Last byte position ({}) is greater than complete '
+                'Last byte position ({}) must be less than complete '
                 'length ({}).'
                 .format(crange.end, crange.total))
-        # Range is zero-indexed
-        if new_chunk.size != crange.end - crange.start:
+        if new_chunk.size != crange.end - crange.start + 1:
             return self._get_range_not_satisfiable_response(
-                "Uploaded content length ({}) doesn't much content "
-                "range ({}) specified in the header."
-                .format(new_chunk.size, crange.end - crange.starts))
+                "Uploaded content length ({}) doesn't match length of "
+                "content range ({}) specified in the header."
+                .format(new_chunk.size, crange.end - crange.start + 1))
 
         try:
             box_upload.append_chunk(new_chunk)
@@ -337,8 +634,29 @@ class BoxUploadHandlerViewSet(UserBoxMixin, RetrieveModelMixin,
                             data={'detail': str(e)})
 
         serializer = self.get_serializer(box_upload)
-        # Range is zero-indexed
-        if crange.end == crange.total:
+        if box_upload.status == BoxUpload.COMPLETED:
+            return Response(data=serializer.data,
+                            status=status.HTTP_201_CREATED)
+        else:
+            return Response(data=serializer.data,
+                            status=status.HTTP_202_ACCEPTED)
+
+    def upload_part(self, request, **kwargs):
+        box_upload = self.get_object()
+
+        new_chunk = request.data.get('file')
+        if not new_chunk:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': "File data wasn't provided."})
+
+        try:
+            box_upload.write_part(int(self.kwargs['part_number']), new_chunk)
+        except AssertionError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST,
+                            data={'detail': str(e)})
+
+        serializer = self.get_serializer(box_upload)
+        if box_upload.status == BoxUpload.COMPLETED:
             return Response(data=serializer.data,
                             status=status.HTTP_201_CREATED)
         else:
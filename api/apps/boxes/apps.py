@@ -5,4 +5,5 @@ class BoxesConfig(AppConfig):
     name = 'apps.boxes'
 
     def ready(self):
+        import apps.boxes.checks
         import apps.boxes.signals
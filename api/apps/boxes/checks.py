@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+@register()
+def check_secure_downloads_counted(app_configs, **kwargs):
+    """ Signed downloads are served by nginx without Django, so their pulls
+    are counted only from its access log.
+    """
+    if settings.SECURE_DOWNLOADS_SECRET and \
+            not settings.BOX_PULLS_FROM_ACCESS_LOG:
+        return [Error(
+            'Pulls of signed downloads are not counted.',
+            hint='Enable BOX_PULLS_FROM_ACCESS_LOG setting and run '
+                 '`ingest_access_log` command, when '
+                 'SECURE_DOWNLOADS_SECRET is set.',
+            id='boxes.E001',
+        )]
+    return []
@@ -0,0 +1,52 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from apps.boxes.models import BoxProvider
+from apps.boxes.utils import get_file_hashes
+
+
+class Command(BaseCommand):
+    help = 'Computes checksums of boxes files with all supported types ' \
+           'and verifies them against provided checksums'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Verify all boxes files, not only ones without checksums',
+        )
+
+    def handle(self, *args, **options):
+        providers = BoxProvider.objects.filled_in().order_by('pk')
+        if not options['all']:
+            providers = providers.filter(
+                Q(checksum_md5='') | Q(checksum_sha1='') |
+                Q(checksum_sha256='')
+            )
+
+        computed = 0
+        corrupted = 0
+        for provider in providers.iterator():
+            checksums = get_file_hashes(provider.file.path)
+            if checksums[provider.checksum_type] != provider.checksum:
+                corrupted += 1
+                self.stderr.write(
+                    "Checksum of {} file ({}) doesn't match provided "
+                    "checksum ({}).".format(
+                        provider, checksums[provider.checksum_type],
+                        provider.checksum)
+                )
+                continue
+
+            # Date modified should not be updated
+            BoxProvider.objects.filter(pk=provider.pk).update(
+                **{'checksum_' + checksum_type: checksum
+                   for checksum_type, checksum in checksums.items()}
+            )
+            computed += 1
+
+        self.stdout.write(
+            self.style.SUCCESS('Successfully computed checksums of {} boxes '
+                               'files, {} corrupted.'
+                               .format(computed, corrupted))
+        )
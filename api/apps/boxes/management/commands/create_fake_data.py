@@ -1,6 +1,7 @@
 import random
 
 import faker
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
 
 from apps.boxes.models import Box
@@ -48,6 +49,9 @@ class Command(BaseCommand):
                 username=fake.user_name(),
             ))
 
+        # Fake providers have random pulls
+        call_command('reconcile_pulls', stdout=self.stdout)
+
         self.stdout.write(
             self.style.SUCCESS(
                 'Successfully created fake users and boxes'
@@ -0,0 +1,118 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.boxes.models import BoxUpload
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Verifies received boxes uploads and fills in their providers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep waiting for new uploads to verify',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=5,
+            help='Seconds to wait between checks for new uploads',
+        )
+
+    def claim_upload(self, pk):
+        """ Takes verifying upload, so other workers skip it.
+
+        Returns the upload or None, when it's taken by another worker.
+        """
+        with transaction.atomic():
+            upload = (BoxUpload.objects
+                      .claimable()
+                      .select_for_update(skip_locked=True)
+                      .filter(pk=pk)
+                      .first())
+            if upload is None:
+                return None
+            upload.claimed_at = timezone.now()
+            BoxUpload.objects.filter(pk=pk).update(
+                claimed_at=upload.claimed_at)
+            return upload
+
+    def verify_upload(self, upload):
+        """ Verifies claimed `upload`.
+
+        Returns whether it's completed or None, when its claim
+        was taken over by another worker.
+        """
+        try:
+            # File is hashed without locking the upload, so it
+            # doesn't hold a transaction open for a long time
+            running_hash = upload.hash_file()
+            with transaction.atomic():
+                upload = (BoxUpload.objects
+                          .verifying()
+                          .select_for_update()
+                          .filter(pk=upload.pk, claimed_at=upload.claimed_at)
+                          .first())
+                if upload is None:
+                    return None
+                try:
+                    upload.complete(running_hash)
+                except AssertionError as e:
+                    logger.warning('Upload {} failed: {}'.format(upload, e))
+                    return False
+        except Exception:
+            # Upload is failed, so it isn't retried by every worker
+            # restart, blocking uploads after it
+            if not BoxUpload.objects.verifying().filter(
+                    pk=upload.pk, claimed_at=upload.claimed_at,
+            ).update(status=BoxUpload.FAILED):
+                # Claim was taken over by another worker meanwhile
+                return None
+            logger.exception('Upload {} failed'.format(upload.pk))
+            return False
+        return True
+
+    def finalize_upload(self, pk):
+        upload = self.claim_upload(pk)
+        if upload is None:
+            return None
+        return self.verify_upload(upload)
+
+    def finalize_uploads(self):
+        completed = 0
+        expired = BoxUpload.objects.verifying_expired()
+        for pk in expired.values_list('pk', flat=True):
+            logger.warning('Upload {} failed: verification expired'
+                           .format(pk))
+        failed = expired.update(status=BoxUpload.FAILED)
+
+        pks = BoxUpload.objects.claimable().order_by('date_modified')\
+            .values_list('pk', flat=True)
+        for pk in pks:
+            result = self.finalize_upload(pk)
+            if result is True:
+                completed += 1
+            elif result is False:
+                failed += 1
+        return completed, failed
+
+    def handle(self, *args, **options):
+        while True:
+            completed, failed = self.finalize_uploads()
+            if completed or failed or not options['loop']:
+                self.stdout.write(
+                    self.style.SUCCESS('Successfully verified {} uploads, '
+                                       '{} uploads failed.'
+                                       .format(completed, failed))
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
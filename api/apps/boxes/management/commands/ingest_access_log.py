@@ -0,0 +1,204 @@
+import logging
+import os
+import re
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from apps.boxes.models import AccessLogPosition, BoxProvider
+from apps.boxes.pulls import save_pulls
+
+
+logger = logging.getLogger(__name__)
+
+# Request of nginx `combined` log format:
+# $remote_addr - $remote_user [$time_local] "$request" $status ...
+LOG_LINE_RE = re.compile(
+    r'\[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>[^ "]+)[^"]*" '
+    r'(?P<status>\d{3}) '
+)
+LOG_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+
+class Command(BaseCommand):
+    help = 'Counts boxes pulls from nginx access log'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path',
+            default=settings.NGINX_ACCESS_LOG,
+            help='Path to nginx access log',
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep counting pulls from new log lines',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=60,
+            help='Seconds to wait between reads of the log',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=16 * 1024 * 1024,
+            help='Bytes of the log counted in one transaction',
+        )
+
+    def handle(self, *args, **options):
+        if not settings.BOX_PULLS_FROM_ACCESS_LOG:
+            # Pulls are counted on download, counting them
+            # from the log would count them twice
+            self.stdout.write('Pulls are counted on download, '
+                              'BOX_PULLS_FROM_ACCESS_LOG is disabled.')
+            return
+
+        self.batch_size = options['batch_size']
+        while True:
+            pulls = self.ingest(options['path'])
+            self.stdout.write(
+                self.style.SUCCESS('Successfully counted {} pulls.'
+                                   .format(pulls))
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def ingest(self, path):
+        self.providers = {}
+        position, _ = AccessLogPosition.objects.get_or_create(path=path)
+        stat = os.stat(path)
+        pulls = 0
+
+        if position.inode is not None and position.inode != stat.st_ino:
+            # Log was rotated, so the rest of the old log is read first
+            rotated_path = path + '.1'
+            if (os.path.exists(rotated_path) and
+                    os.stat(rotated_path).st_ino == position.inode):
+                pulls += self.ingest_file(position, rotated_path)
+            position.offset = 0
+        elif stat.st_size < position.offset:
+            # Log was truncated
+            position.offset = 0
+        position.inode = stat.st_ino
+
+        pulls += self.ingest_file(position, path)
+        position.save()
+        return pulls
+
+    def ingest_file(self, position, path):
+        pulls = 0
+        with open(path, 'rb') as log:
+            log.seek(position.offset)
+            while True:
+                data = log.read(self.batch_size)
+                end = data.rfind(b'\n') + 1
+                if not end and len(data) == self.batch_size:
+                    # Line is longer than the batch, it isn't a pull
+                    # of a box, so it's skipped
+                    end = self.skip_line(log)
+                    if end is None:
+                        break
+                    logger.warning(
+                        'Skipped line of {} bytes at {} of {}'.format(
+                            end - position.offset, position.offset, path))
+                    position.offset = end
+                    position.save()
+                    log.seek(position.offset)
+                    continue
+                if not end:
+                    # Last line may still be being written
+                    break
+                lines = data[:end].decode('utf-8', 'replace').splitlines()
+                with transaction.atomic():
+                    pulls += self.save_pulls(lines)
+                    position.offset += end
+                    position.save()
+                log.seek(position.offset)
+        return pulls
+
+    def skip_line(self, log):
+        """ Returns position in `log` after the end of the current line
+        or None, when the line is still being written.
+        """
+        while True:
+            data = log.read(self.batch_size)
+            if not data:
+                return None
+            end = data.find(b'\n') + 1
+            if end:
+                return log.tell() - len(data) + end
+
+    def save_pulls(self, lines):
+        counts_by_date = OrderedDict()
+        for line in lines:
+            pull = self.parse_line(line)
+            if pull is None:
+                continue
+            date_created, provider_id = pull
+            # Pulls are rolled up by dates in the current time zone
+            date = timezone.localdate(date_created)
+            if date not in counts_by_date:
+                counts_by_date[date] = (date_created, Counter())
+            counts_by_date[date][1][provider_id] += 1
+
+        pulls = 0
+        for date_created, counts in counts_by_date.values():
+            save_pulls(counts, date_created)
+            pulls += sum(counts.values())
+        return pulls
+
+    def parse_line(self, line):
+        """ Returns time of the pull and provider id, when line is a pull. """
+        match = LOG_LINE_RE.search(line)
+        if not match or match.group('method') != 'GET' or \
+                match.group('status') != '200':
+            return None
+
+        path = unquote(match.group('path').split('?', 1)[0])
+        provider_id = self.get_provider_id(path)
+        if provider_id is None:
+            return None
+        return (datetime.strptime(match.group('time'), LOG_TIME_FORMAT),
+                provider_id)
+
+    def get_provider_id(self, path):
+        if path not in self.providers:
+            self.providers[path] = self.find_provider_id(path)
+        return self.providers[path]
+
+    def find_provider_id(self, path):
+        if path.startswith(settings.SECURE_DOWNLOADS_URL):
+            # Signed download, which includes provider id
+            provider_id = path[len(settings.SECURE_DOWNLOADS_URL):]\
+                .split('/', 1)[0]
+            if not provider_id.isdigit():
+                return None
+            providers = BoxProvider.objects.filter(pk=provider_id)
+        elif path.startswith(settings.PROTECTED_MEDIA_URL):
+            # Box file served by nginx without Django
+            providers = BoxProvider.objects.filter(
+                file=path[len(settings.PROTECTED_MEDIA_URL):])
+        else:
+            try:
+                match = resolve(path)
+            except Resolver404:
+                return None
+            if match.url_name != 'downloads-box':
+                return None
+            providers = BoxProvider.objects.filter(
+                version__box__owner__username=match.kwargs['username'],
+                version__box__name=match.kwargs['box_name'],
+                version__version=match.kwargs['version'],
+                provider=match.kwargs['provider'],
+            )
+        return providers.order_by('pk').values_list('pk', flat=True).first()
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+
+from apps.boxes.models import (
+    BoxProvider, blob_path, find_box_file, protected_storage)
+from apps.boxes.utils import get_file_hashes, link_file
+
+
+class Command(BaseCommand):
+    help = 'Moves boxes files into content addressed storage, ' \
+           'so duplicated files are stored only once'
+
+    def handle(self, *args, **options):
+        moved = 0
+        corrupted = 0
+        # Blobs were named by declared checksums of any type before,
+        # now they are named by sha256 computed by the server
+        providers = (BoxProvider.objects
+                     .filled_in()
+                     .exclude(file__startswith='blobs/sha256/')
+                     .order_by('pk'))
+        for provider in providers.iterator():
+            old_name = provider.file.name
+            checksums = get_file_hashes(provider.file.path)
+            if checksums[provider.checksum_type] != provider.checksum:
+                corrupted += 1
+                self.stderr.write(
+                    "Checksum of {} file ({}) doesn't match provided "
+                    "checksum ({}).".format(
+                        provider, checksums[provider.checksum_type],
+                        provider.checksum)
+                )
+                continue
+
+            name = self.link_blob(provider, checksums[BoxProvider.SHA256])
+            # Date modified should not be updated
+            BoxProvider.objects.filter(pk=provider.pk).update(
+                file=name,
+                **{'checksum_' + checksum_type: checksum
+                   for checksum_type, checksum in checksums.items()}
+            )
+            if not BoxProvider.objects.filter(file=old_name).exists():
+                protected_storage.delete(old_name)
+            moved += 1
+
+        self.stdout.write(
+            self.style.SUCCESS('Successfully moved {} boxes files, '
+                               '{} corrupted.'.format(moved, corrupted))
+        )
+
+    def link_blob(self, provider, sha256):
+        name = blob_path(BoxProvider.SHA256, sha256)
+        stored_name = find_box_file(provider.file_size, sha256)
+        if stored_name is not None:
+            try:
+                return link_file(protected_storage, stored_name, name)
+            except FileNotFoundError:
+                pass
+        return link_file(protected_storage, provider.file.name, name)
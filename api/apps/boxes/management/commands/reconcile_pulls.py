@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from apps.boxes.models import Box
+
+
+class Command(BaseCommand):
+    help = 'Sets total pulls of boxes to sums of pulls of their providers'
+
+    def handle(self, *args, **options):
+        boxes = (Box.objects
+                 .annotate_providers_pulls()
+                 .exclude(total_pulls=F('providers_pulls'))
+                 .values_list('pk', 'total_pulls', 'providers_pulls'))
+
+        reconciled = 0
+        for box_id, total_pulls, providers_pulls in boxes.iterator():
+            # Pulls saved meanwhile are added to both values
+            Box.objects.filter(pk=box_id).update(
+                total_pulls=F('total_pulls') + providers_pulls - total_pulls)
+            reconciled += 1
+
+        self.stdout.write(
+            self.style.SUCCESS('Successfully reconciled pulls of {} boxes.'
+                               .format(reconciled))
+        )
@@ -0,0 +1,85 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Sum
+from django.db.models.functions import TruncDate
+
+from apps.boxes.models import BoxDailyPulls, BoxPull
+
+
+class Command(BaseCommand):
+    help = 'Rolls up boxes pulls into daily pulls and deletes them'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Keep rolling up new pulls',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=3600,
+            help='Seconds to wait between roll ups',
+        )
+
+    # Number of pulls records rolled up in one transaction
+    batch_size = 500
+
+    def rollup_pulls(self):
+        # Pulls saved while command runs are left for the next run
+        last_pk = BoxPull.objects.aggregate(pk=Max('pk'))['pk'] or 0
+        deleted = days = 0
+        while True:
+            pks = list(BoxPull.objects
+                       .filter(pk__lte=last_pk)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                break
+            batch_deleted, batch_days = self.rollup_batch(pks)
+            deleted += batch_deleted
+            days += batch_days
+        return deleted, days
+
+    @transaction.atomic
+    def rollup_batch(self, pks):
+        # Only selected pulls are deleted, so pulls committed
+        # after they were counted aren't lost
+        pulls = BoxPull.objects.filter(pk__in=pks)
+        daily_pulls = (pulls
+                       .annotate(date=TruncDate('date_created'))
+                       .values('provider_id', 'date')
+                       .annotate(pulls=Sum('pulls'))
+                       .order_by())
+        days = 0
+        for row in daily_pulls:
+            self.add_daily_pulls(row)
+            days += 1
+
+        deleted, _ = pulls.delete()
+        return deleted, days
+
+    def add_daily_pulls(self, row):
+        updated = BoxDailyPulls.objects.filter(
+            provider_id=row['provider_id'], date=row['date'],
+        ).update(pulls=F('pulls') + row['pulls'])
+        if not updated:
+            BoxDailyPulls.objects.create(
+                provider_id=row['provider_id'],
+                date=row['date'],
+                pulls=row['pulls'],
+            )
+
+    def handle(self, *args, **options):
+        while True:
+            deleted, days = self.rollup_pulls()
+            self.stdout.write(
+                self.style.SUCCESS('Successfully rolled up {} pulls records '
+                                   'into {} daily pulls.'
+                                   .format(deleted, days))
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,169 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch
+
+from apps.boxes.models import Box, BoxMetadata, BoxProvider, BoxVersion
+from apps.boxes.serializers import BoxMetadataSerializer
+
+
+def get_metadata_boxes():
+    return (Box.objects
+            .select_related('owner')
+            .prefetch_related(Prefetch(
+                'versions',
+                queryset=(BoxVersion.objects
+                          .order_by_version()
+                          .prefetch_related('providers')))))
+
+
+def get_metadata_box(box_id):
+    return get_metadata_boxes().filter(pk=box_id).first()
+
+
+def build_metadata(box):
+    # Serialized without request, so URLs are relative
+    return json.dumps(BoxMetadataSerializer(box).data)
+
+
+def rebuild_metadata(box_id, create=True):
+    """ Updates metadata document of the box.
+
+    Document is created in advance only for public boxes, which
+    metadata is served as a static file, others are created, when
+    metadata is requested.
+    """
+    metadata = BoxMetadata.objects.filter(box_id=box_id).first()
+    if metadata is None and not (create and settings.BOX_METADATA_BASE_URL):
+        return
+
+    box = get_metadata_box(box_id)
+    if box is None:
+        return
+    if metadata is None:
+        if box.visibility != Box.PUBLIC:
+            return
+        metadata = BoxMetadata(box=box)
+
+    metadata.document = build_metadata(box)
+    save_metadata(metadata, box)
+
+
+def create_metadata(box):
+    """ Stores metadata document of the box, which wasn't served yet. """
+    metadata = BoxMetadata(
+        box=box, document=build_metadata(get_metadata_box(box.pk)))
+    try:
+        with transaction.atomic():
+            save_metadata(metadata, box)
+    except IntegrityError:
+        # Created by concurrent request
+        return BoxMetadata.objects.get(box=box)
+    return metadata
+
+
+def save_metadata(metadata, box):
+    """ Saves metadata document and its static file for public boxes. """
+    old_static_path = metadata.static_path
+    if settings.BOX_METADATA_BASE_URL and box.visibility == Box.PUBLIC:
+        metadata.static_path = '{}/{}.json'.format(box.owner.username,
+                                                   box.name)
+    else:
+        metadata.static_path = ''
+    metadata.save()
+
+    if old_static_path and old_static_path != metadata.static_path:
+        transaction.on_commit(
+            lambda: delete_static_metadata(old_static_path))
+    if metadata.static_path:
+        data = complete_metadata(
+            metadata, lambda url: settings.BOX_METADATA_BASE_URL + url,
+            secure_downloads=False)
+        static_path = metadata.static_path
+        transaction.on_commit(
+            lambda: write_static_metadata(static_path, data))
+
+
+def write_static_metadata(static_path, data):
+    path = os.path.join(settings.BOX_METADATA_ROOT, static_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # File is replaced at once, so nginx never serves a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'w') as f:
+        json.dump(data, f)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def delete_static_metadata(static_path):
+    try:
+        os.remove(os.path.join(settings.BOX_METADATA_ROOT, static_path))
+    except FileNotFoundError:
+        pass
+
+
+def get_secure_urls(box_ids):
+    """ Returns signed download URLs of providers of boxes,
+    by box id, version and provider name.
+    """
+    secure_urls = {}
+    if not settings.SECURE_DOWNLOADS_SECRET:
+        return secure_urls
+
+    providers = (BoxProvider.objects
+                 .filled_in()
+                 .filter(version__box_id__in=box_ids)
+                 .values_list('version__box_id', 'version__version',
+                              'provider', 'pk', 'file'))
+    for box_id, version, provider, pk, file_name in providers:
+        secure_urls[box_id, version, provider] = BoxProvider(
+            pk=pk, file=file_name).get_secure_download_url()
+    return secure_urls
+
+
+def complete_document(box_id, document, build_absolute_uri, secure_urls):
+    data = json.loads(document)
+    for version in data['versions']:
+        for provider in version['providers']:
+            url = secure_urls.get(
+                (box_id, version['version'], provider['name']))
+            provider['url'] = build_absolute_uri(url or provider['url'])
+    return data
+
+
+def complete_metadata(metadata, build_absolute_uri, secure_downloads=True):
+    """ Returns metadata document with absolute URLs. """
+    secure_urls = {}
+    if secure_downloads:
+        secure_urls = get_secure_urls([metadata.box_id])
+    return complete_document(metadata.box_id, metadata.document,
+                             build_absolute_uri, secure_urls)
+
+
+def complete_boxes_metadata(boxes, build_absolute_uri):
+    """ Returns metadata documents of `boxes` with absolute URLs by box id.
+
+    Boxes should be fetched along with their metadata. Documents of
+    boxes, which metadata wasn't requested yet, are built, but not
+    stored, so the number of queries doesn't depend on number of boxes.
+    """
+    documents = {}
+    missing = []
+    for box in boxes:
+        try:
+            documents[box.pk] = box.metadata.document
+        except BoxMetadata.DoesNotExist:
+            missing.append(box.pk)
+    if missing:
+        for box in get_metadata_boxes().filter(pk__in=missing):
+            documents[box.pk] = build_metadata(box)
+
+    secure_urls = get_secure_urls(list(documents))
+    return {
+        box_id: complete_document(
+            box_id, document, build_absolute_uri, secure_urls)
+        for box_id, document in documents.items()
+    }
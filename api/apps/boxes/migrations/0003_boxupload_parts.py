@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0002_auto_20170416_2050'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxupload',
+            name='part_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='BoxUploadPart',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('size', models.BigIntegerField()),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='boxes.BoxUpload')),
+            ],
+            options={
+                'ordering': ['number'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='boxuploadpart',
+            unique_together=set([('upload', 'number')]),
+        ),
+    ]
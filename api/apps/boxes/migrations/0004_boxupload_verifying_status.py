@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0003_boxupload_parts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='boxupload',
+            name='status',
+            field=models.CharField(choices=[('S', 'Started'), ('I', 'In progress'), ('V', 'Verifying'), ('C', 'Completed'), ('F', 'Failed')], default='S', max_length=1),
+        ),
+    ]
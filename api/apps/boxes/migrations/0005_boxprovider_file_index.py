@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import apps.boxes.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0004_boxupload_verifying_status'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='boxprovider',
+            name='file',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=apps.boxes.models.protected_storage, upload_to=apps.boxes.models.user_box_upload_path),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0005_boxprovider_file_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxprovider',
+            name='checksum_md5',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='boxprovider',
+            name='checksum_sha1',
+            field=models.CharField(blank=True, editable=False, max_length=40),
+        ),
+        migrations.AddField(
+            model_name='boxprovider',
+            name='checksum_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0006_boxprovider_checksums'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxupload',
+            name='preallocated',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
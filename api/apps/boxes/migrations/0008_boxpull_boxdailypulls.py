@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0007_boxupload_preallocated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoxDailyPulls',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('pulls', models.PositiveIntegerField(default=0)),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_pulls', to='boxes.BoxProvider')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'verbose_name_plural': 'Box daily pulls',
+            },
+        ),
+        migrations.CreateModel(
+            name='BoxPull',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('pulls', models.PositiveIntegerField(default=1)),
+                ('provider', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='boxes.BoxProvider')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='boxdailypulls',
+            unique_together=set([('provider', 'date')]),
+        ),
+    ]
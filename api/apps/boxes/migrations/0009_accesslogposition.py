@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0008_boxpull_boxdailypulls'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccessLogPosition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255, unique=True)),
+                ('inode', models.BigIntegerField(null=True)),
+                ('offset', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
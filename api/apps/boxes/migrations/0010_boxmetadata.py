@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0009_accesslogposition'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BoxMetadata',
+            fields=[
+                ('box', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metadata', serialize=False, to='boxes.Box')),
+                ('document', models.TextField()),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'box metadata',
+            },
+        ),
+    ]
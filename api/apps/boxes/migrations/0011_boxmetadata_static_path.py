@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0010_boxmetadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxmetadata',
+            name='static_path',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+
+
+VERSION_RE = re.compile(r'^(\d+)\.(\d+)(\.(\d+))?$')
+# Maximum value of `PositiveIntegerField` on all databases
+VERSION_COMPONENT_MAX = 2147483647
+
+
+def fill_in_version_components(apps, schema_editor):
+    BoxVersion = apps.get_model('boxes', 'BoxVersion')
+
+    for version in BoxVersion.objects.only('version').iterator():
+        match = VERSION_RE.match(version.version)
+        if match is None:
+            continue
+        # Numbers too large for the fields are ordered as the largest ones
+        major, minor, patch = (
+            min(int(number or 0), VERSION_COMPONENT_MAX)
+            for number in match.group(1, 2, 4))
+        BoxVersion.objects.filter(pk=version.pk).update(
+            version_major=major,
+            version_minor=minor,
+            version_patch=patch,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0011_boxmetadata_static_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='boxversion',
+            name='version_major',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='boxversion',
+            name='version_minor',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='boxversion',
+            name='version_patch',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            fill_in_version_components, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='boxversion',
+            index=models.Index(fields=['box', 'version_major', 'version_minor', 'version_patch'], name='boxes_boxversion_semver_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_in_total_pulls(apps, schema_editor):
+    Box = apps.get_model('boxes', 'Box')
+    BoxProvider = apps.get_model('boxes', 'BoxProvider')
+
+    Box.objects.update(total_pulls=Coalesce(
+        Subquery(
+            BoxProvider.objects
+            .filter(version__box=OuterRef('pk'))
+            .order_by()
+            .values('version__box')
+            .annotate(pulls=Sum('pulls'))
+            .values('pulls'),
+            output_field=models.IntegerField(),
+        ),
+        0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0012_boxversion_semver'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='box',
+            name='total_pulls',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_in_total_pulls, migrations.RunPython.noop),
+    ]
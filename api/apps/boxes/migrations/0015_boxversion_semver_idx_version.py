@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('boxes', '0014_boxprovider_checksum_sha256_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='boxversion',
+            name='boxes_boxversion_semver_idx',
+        ),
+        migrations.AddIndex(
+            model_name='boxversion',
+            index=models.Index(fields=['box', 'version_major', 'version_minor', 'version_patch', 'version'], name='boxes_boxversion_semver_idx'),
+        ),
+    ]
@@ -1,6 +1,12 @@
+import errno
 import logging
+import os
+import re
+import time
 import uuid
+from collections import OrderedDict
 from datetime import timedelta
+from urllib.parse import quote, urlencode
 
 from django.db.models.functions import Coalesce
 from humanize import naturalsize
@@ -8,12 +14,14 @@ from humanize import naturalsize
 from django.core.files.storage import FileSystemStorage
 from django.urls import reverse
 from django.core.validators import RegexValidator
-from django.db import models
-from django.db.models import Q, Sum
+from django.db import models, transaction
+from django.db.models import (
+    Case, F, OuterRef, Q, Subquery, Sum, Value, When)
 from django.utils import timezone
 from django.conf import settings
 
-from apps.boxes.utils import get_file_hash
+from apps.boxes.utils import (
+    RunningHash, copy_file, get_secure_link_hash, link_file, running_hashes)
 
 
 logger = logging.getLogger(__name__)
@@ -39,20 +47,36 @@ class BoxQuerySet(models.QuerySet):
             # Staff has access to all boxes
             return self
 
-        return (self
-                .filter(
-                    Q(shared_with=user) |
-                    Q(visibility=Box.PUBLIC) |
-                    Q(owner=user))
-                .distinct())
+        # Membership is checked by an uncorrelated subquery rather than
+        # a join, so boxes aren't duplicated and don't need DISTINCT
+        shared_with_user = BoxMember.objects.filter(user=user).values('box')
+        return self.filter(
+            Q(pk__in=shared_with_user) |
+            Q(visibility=Box.PUBLIC) |
+            Q(owner=user))
 
     def by_owner(self, user):
         return self.filter(owner=user)
 
     def annotate_pulls(self):
-        return self.annotate(
-            pulls=Coalesce(Sum('versions__providers__pulls'), 0)
-        )
+        return self.annotate(pulls=F('total_pulls'))
+
+    def annotate_providers_pulls(self):
+        """ Annotates sum of pulls of providers of boxes, which
+        `total_pulls` is maintained to be equal to.
+        """
+        return self.annotate(providers_pulls=Coalesce(
+            Subquery(
+                BoxProvider.objects
+                .filter(version__box=OuterRef('pk'))
+                .order_by()
+                .values('version__box')
+                .annotate(pulls=Sum('pulls'))
+                .values('pulls'),
+                output_field=models.IntegerField(),
+            ),
+            0
+        ))
 
 
 class Box(models.Model):
@@ -79,6 +103,9 @@ class Box(models.Model):
     )
     visibility = models.CharField(
         max_length=2, choices=VISIBILITY_CHOICES, default=PRIVATE)
+    # Pulls of all providers of the box, so boxes are ordered by an index
+    total_pulls = models.PositiveIntegerField(
+        default=0, db_index=True, editable=False)
     name = models.CharField(
         max_length=30,
         validators=[
@@ -108,31 +135,41 @@ class Box(models.Model):
     def tag(self):
         return '{}/{}'.format(self.owner, self.name)
 
+    def set_member_permissions(self, user, permissions):
+        """ Sets permissions of `user` membership fetched along
+        with the box, None when user isn't a member.
+        """
+        self._member_permissions = (user.pk, permissions)
+
+    def get_member_permissions(self, user):
+        user_id, permissions = getattr(
+            self, '_member_permissions', (None, None))
+        if user_id == user.pk:
+            return permissions
+        return (self.boxmember_set
+                .filter(user=user)
+                .values_list('permissions', flat=True)
+                .first())
+
     def get_perms_for_user(self, user):
         is_authenticated = user and user.is_authenticated
         is_staff = is_authenticated and user.is_staff
-        is_owner = is_authenticated and self.owner == user
+        is_owner = is_authenticated and self.owner_id == user.pk
 
         if is_staff or is_owner:
             # Staff and owner have all permissions on the box
             return BoxMember.PERM_OWNER_OR_STAFF
 
         if is_authenticated:
-            try:
-                return self.boxmember_set.get(user=user).permissions
-            except BoxMember.DoesNotExist:
-                visibility_perms = {
-                    self.PUBLIC: BoxMember.PERM_R,
-                    self.PRIVATE: BoxMember.PERM_NONE,
-                }
-                return visibility_perms[self.visibility]
+            permissions = self.get_member_permissions(user)
+            if permissions is not None:
+                return permissions
 
-        else:
-            visibility_perms = {
-                self.PUBLIC: BoxMember.PERM_R,
-                self.PRIVATE: BoxMember.PERM_NONE,
-            }
-            return visibility_perms[self.visibility]
+        visibility_perms = {
+            self.PUBLIC: BoxMember.PERM_R,
+            self.PRIVATE: BoxMember.PERM_NONE,
+        }
+        return visibility_perms[self.visibility]
 
     def user_has_perms(self, user, need_perms):
         has_perms = self.get_perms_for_user(user)
@@ -178,6 +215,97 @@ class BoxMember(models.Model):
         return self.box.user_has_perms(perms, user)
 
 
+# Lookups of Vagrant version constraint operators
+VERSION_CONSTRAINT_LOOKUPS = {
+    '=': 'exact',
+    '>': 'gt',
+    '>=': 'gte',
+    '<': 'lt',
+    '<=': 'lte',
+}
+VERSION_CONSTRAINT_RE = re.compile(r'^\s*(=|!=|>=|<=|>|<|~>)?\s*(\S+)\s*$')
+
+
+def get_version_q(lookup, version, prefix=''):
+    """ Returns Q of versions compared to `version` by `lookup`,
+    which is one of 'exact', 'gt', 'gte', 'lt' and 'lte'.
+
+    Fields of versions are prefixed with `prefix`, e.g. 'version__'.
+    """
+    major, minor, patch = BoxVersion.parse_version(version)
+    major_field = prefix + 'version_major'
+    minor_field = prefix + 'version_minor'
+    patch_field = prefix + 'version_patch'
+    if lookup == 'exact':
+        return Q(**{major_field: major, minor_field: minor,
+                    patch_field: patch})
+
+    strict_lookup = lookup[:2]
+    return (
+        Q(**{major_field + '__' + strict_lookup: major}) |
+        Q(**{major_field: major,
+             minor_field + '__' + strict_lookup: minor}) |
+        Q(**{major_field: major, minor_field: minor,
+             patch_field + '__' + lookup: patch})
+    )
+
+
+def get_version_constraint_q(constraint, prefix=''):
+    """ Returns Q of versions satisfying Vagrant version `constraint`,
+    e.g. '>= 2.1, < 3.0' or '~> 2.1'.
+
+    Raises ValueError, when constraint is invalid.
+    """
+    q = Q()
+    for requirement in constraint.split(','):
+        match = VERSION_CONSTRAINT_RE.match(requirement)
+        if match is None:
+            raise ValueError(
+                'Invalid version constraint: {}'.format(requirement.strip()))
+        operator, version = match.group(1) or '=', match.group(2)
+
+        if operator == '~>':
+            # Last specified component may increase,
+            # e.g. '~> 2.1' means '>= 2.1, < 3.0'
+            major, minor, patch = BoxVersion.parse_version(version)
+            if version.count('.') == 2:
+                upper_version = '{}.{}.0'.format(major, minor + 1)
+            else:
+                upper_version = '{}.0.0'.format(major + 1)
+            q &= (get_version_q('gte', version, prefix) &
+                  get_version_q('lt', upper_version, prefix))
+        elif operator == '!=':
+            q &= ~get_version_q('exact', version, prefix)
+        else:
+            q &= get_version_q(
+                VERSION_CONSTRAINT_LOOKUPS[operator], version, prefix)
+    return q
+
+
+class BoxVersionQuerySet(models.QuerySet):
+
+    def order_by_version(self):
+        """ Orders versions from the latest one.
+
+        Equal versions, like 1.2 and 1.2.0, are ordered by their strings.
+        """
+        return self.order_by(
+            '-version_major', '-version_minor', '-version_patch', '-version')
+
+    def filter_version(self, lookup, version):
+        """ Filters versions compared to `version` by `lookup`,
+        which is one of 'exact', 'gt', 'gte', 'lt' and 'lte'.
+        """
+        return self.filter(get_version_q(lookup, version))
+
+    def filter_constraint(self, constraint):
+        """ Filters versions satisfying Vagrant version `constraint`. """
+        return self.filter(get_version_constraint_q(constraint))
+
+    def newer_than(self, version):
+        return self.filter_version('gt', version)
+
+
 class BoxVersion(models.Model):
     # Validate version according to Vagrant docs
     # https://www.vagrantup.com/docs/boxes/versioning.html
@@ -186,6 +314,10 @@ class BoxVersion(models.Model):
         message='Invalid version number. It must be of the format '
                 'X.Y.Z where X, Y, and Z are all positive integers.'
     )
+    # Maximum value of `PositiveIntegerField` on all databases
+    VERSION_COMPONENT_MAX = 2147483647
+
+    objects = BoxVersionQuerySet.as_manager()
 
     box = models.ForeignKey(
         'boxes.Box', related_name='versions', on_delete=models.CASCADE)
@@ -198,16 +330,56 @@ class BoxVersion(models.Model):
     )
     version = models.CharField(
         max_length=40, validators=[VERSION_VALIDATOR])
+    # Components of `version`, so versions are ordered by the database
+    version_major = models.PositiveIntegerField(default=0, editable=False)
+    version_minor = models.PositiveIntegerField(default=0, editable=False)
+    version_patch = models.PositiveIntegerField(default=0, editable=False)
     changes = models.TextField(blank=True)
 
     class Meta:
         unique_together = ('box', 'version')
         verbose_name_plural = 'box versions'
         ordering = ['-date_updated']
+        indexes = [
+            models.Index(
+                fields=['box', 'version_major', 'version_minor',
+                        'version_patch', 'version'],
+                name='boxes_boxversion_semver_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.tag
 
+    def save(self, *args, **kwargs):
+        # Versions saved before they were validated may not match the
+        # format or have too large numbers, they're stored like by 0012
+        # migration, so such versions can still be edited
+        match = self.VERSION_VALIDATOR.regex.match(self.version)
+        if match is None:
+            numbers = (0, 0, 0)
+        else:
+            numbers = (min(int(number or 0), self.VERSION_COMPONENT_MAX)
+                       for number in match.group(1, 2, 4))
+        (self.version_major, self.version_minor,
+         self.version_patch) = numbers
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def parse_version(cls, version):
+        """ Returns major, minor and patch numbers of `version`.
+
+        Raises ValueError, when version is invalid.
+        """
+        match = cls.VERSION_VALIDATOR.regex.match(version)
+        if match is None:
+            raise ValueError('Invalid version: {}'.format(version))
+        numbers = (int(match.group(1)), int(match.group(2)),
+                   int(match.group(4) or 0))
+        if max(numbers) > cls.VERSION_COMPONENT_MAX:
+            raise ValueError('Invalid version: {}'.format(version))
+        return numbers
+
     @property
     def tag(self):
         return '{} v{}'.format(self.box, self.version)
@@ -234,6 +406,37 @@ def user_box_upload_path(instance, filename):
     )
 
 
+def blob_path(checksum_type, checksum):
+    return 'blobs/{checksum_type}/{prefix}/{checksum}.box'.format(
+        checksum_type=checksum_type,
+        prefix=checksum[:2],
+        checksum=checksum,
+    )
+
+
+def find_box_file(file_size, sha256):
+    """ Returns name of a stored box file of `file_size` bytes with
+    `sha256` checksum, None when there isn't one.
+
+    Checksums were computed, when providers were filled in, so files
+    aren't read again, only their sizes are checked. Only blobs named
+    by sha256 are looked up, as ones named by declared md5 or sha1
+    could be shared by different files.
+    """
+    names = (BoxProvider.objects
+             .filled_in()
+             .filter(file_size=file_size, checksum_sha256=sha256,
+                     file__startswith='blobs/sha256/')
+             .values_list('file', flat=True))
+    for name in names:
+        try:
+            if protected_storage.size(name) == file_size:
+                return name
+        except FileNotFoundError:
+            continue
+    return None
+
+
 class BoxProviderQuerySet(models.QuerySet):
 
     def empty(self):
@@ -279,6 +482,7 @@ class BoxProvider(models.Model):
         storage=protected_storage,
         null=True,
         blank=True,
+        db_index=True,
     )
     file_size = models.BigIntegerField(
         default=0,
@@ -294,6 +498,25 @@ class BoxProvider(models.Model):
         max_length=128,
         editable=False,
     )
+    # Digests of the file with each supported checksum type,
+    # so it can be verified with any of them
+    checksum_md5 = models.CharField(
+        max_length=32,
+        blank=True,
+        editable=False,
+    )
+    checksum_sha1 = models.CharField(
+        max_length=40,
+        blank=True,
+        editable=False,
+    )
+    checksum_sha256 = models.CharField(
+        max_length=64,
+        blank=True,
+        editable=False,
+        # Files with the same content are looked up by it
+        db_index=True,
+    )
     pulls = models.PositiveIntegerField(
         default=0,
         editable=False,
@@ -316,6 +539,17 @@ class BoxProvider(models.Model):
     def tag(self):
         return '{} {}'.format(self.version, self.provider)
 
+    @property
+    def checksums(self):
+        return OrderedDict(
+            (checksum_type, getattr(self, 'checksum_' + checksum_type))
+            for checksum_type, _ in self.CHECKSUM_TYPE_CHOICES
+        )
+
+    def set_checksums(self, checksums):
+        for checksum_type, checksum in checksums.items():
+            setattr(self, 'checksum_' + checksum_type, checksum)
+
     @property
     def download_url(self):
         return reverse(
@@ -328,6 +562,26 @@ class BoxProvider(models.Model):
             }
         )
 
+    def get_secure_download_url(self):
+        """ Returns download URL signed for nginx, which expires
+        in `SECURE_DOWNLOADS_EXPIRE_AFTER` seconds.
+
+        Returns None, when signed downloads are disabled.
+        """
+        if not settings.SECURE_DOWNLOADS_SECRET or not self.file:
+            return None
+
+        # Provider is a part of URL, so the download
+        # can be counted from nginx access log
+        path = '{}{}/{}'.format(
+            settings.SECURE_DOWNLOADS_URL, self.pk, self.file.name)
+        expires = int(time.time()) + settings.SECURE_DOWNLOADS_EXPIRE_AFTER
+        return '{}?{}'.format(quote(path), urlencode({
+            'md5': get_secure_link_hash(
+                path, expires, settings.SECURE_DOWNLOADS_SECRET),
+            'expires': expires,
+        }))
+
     @property
     def owner(self):
         return self.box.owner
@@ -360,26 +614,65 @@ class BoxUploadQuerySet(models.QuerySet):
     def active(self):
         expire_date = timezone.now() - timedelta(hours=settings.BOX_UPLOAD_EXPIRE_AFTER)
         return self.exclude(
-            Q(status=BoxUpload.COMPLETED) |
-            Q(date_created__lt=expire_date)
+            Q(status__in=[BoxUpload.COMPLETED, BoxUpload.FAILED]) |
+            Q(date_created__lt=expire_date, status__in=[
+                BoxUpload.STARTED, BoxUpload.IN_PROGRESS])
         )
 
     def not_active(self):
         expire_date = timezone.now() - timedelta(hours=settings.BOX_UPLOAD_EXPIRE_AFTER)
         return self.filter(
-            Q(status=BoxUpload.COMPLETED) |
-            Q(date_created__lt=expire_date)
+            Q(status__in=[BoxUpload.COMPLETED, BoxUpload.FAILED]) |
+            Q(date_created__lt=expire_date, status__in=[
+                BoxUpload.STARTED, BoxUpload.IN_PROGRESS])
         )
 
+    def verifying(self):
+        return self.filter(status=BoxUpload.VERIFYING)
+
+    def claimable(self):
+        """ Verifying uploads, which aren't being verified by a worker.
+
+        Claims of workers, which died while verifying, expire.
+        """
+        expire_date = timezone.now() - timedelta(
+            minutes=settings.BOX_UPLOAD_CLAIM_EXPIRE_AFTER)
+        return self.verifying().filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=expire_date))
+
+    def verifying_expired(self):
+        """ Uploads, which are being verified for too long. """
+        expire_date = timezone.now() - timedelta(
+            hours=settings.BOX_UPLOAD_VERIFY_EXPIRE_AFTER)
+        return self.verifying().filter(date_modified__lt=expire_date)
+
+    def reserved_space(self):
+        """ Returns number of bytes uploads still need on disk.
+
+        Preallocated files already take their space,
+        so they don't need to reserve anything.
+        """
+        return self.aggregate(
+            reserved=Coalesce(Sum(Case(
+                When(preallocated=True, then=Value(0)),
+                default=F('file_size') - F('offset'),
+                output_field=models.BigIntegerField(),
+            )), 0)
+        )['reserved']
+
 
 class BoxUpload(models.Model):
     STARTED = 'S'
     IN_PROGRESS = 'I'
+    VERIFYING = 'V'
     COMPLETED = 'C'
+    FAILED = 'F'
     STATUS_CHOICES = (
         (STARTED, 'Started'),
         (IN_PROGRESS, 'In progress'),
+        (VERIFYING, 'Verifying'),
         (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
     )
 
     objects = BoxUploadQuerySet.as_manager()
@@ -410,6 +703,10 @@ class BoxUpload(models.Model):
         max_length=10,
         choices=BoxProvider.CHECKSUM_TYPE_CHOICES)
     checksum = models.CharField(max_length=128)
+    part_size = models.BigIntegerField(null=True, blank=True)
+    preallocated = models.BooleanField(default=False, editable=False)
+    # When verifying upload was taken by a worker
+    claimed_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     class Meta:
         ordering = ['-date_modified']
@@ -467,31 +764,236 @@ class BoxUpload(models.Model):
     def user_has_perms(self, perms, user):
         return self.box.user_has_perms(perms, user)
 
-    def append_chunk(self, chunk):
-        assert self.status != self.COMPLETED, "Upload already completed"
-        assert not self.expired, "Upload expired"
+    @property
+    def parts_count(self):
+        if not self.part_size:
+            return 0
+        return -(-self.file_size // self.part_size)
 
-        if self.file:
-            # Close file opened by Django in 'rb' mode
-            self.file.file.close()
-            self.file.file.open(mode='ab')
-            self.file.file.write(chunk.read())
-            self.file.file.close()
-        else:
-            self.file.save(name=chunk.name, content=chunk)
+    def get_part_size(self, number):
+        return min(self.part_size,
+                   self.file_size - (number - 1) * self.part_size)
 
-        size = self.file.size
-        self.offset = size
-        if size == self.file_size:
-            self._complete_upload()
-        else:
-            self.status = self.IN_PROGRESS
+    def _set_file_name(self, filename='vagrant.box'):
+        if not self.file:
+            self.file.name = self.file.field.generate_filename(
+                self, filename)
+
+    def preallocate(self):
+        """ Allocates disk space for the whole upload file.
 
+        File is laid out contiguously and a full disk is detected,
+        before any data is received.
+        """
+        self._set_file_name()
+        path = self.file.path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            os.posix_fallocate(fd, 0, self.file_size)
+            self.preallocated = True
+        except OSError as e:
+            # File system can't preallocate files,
+            # so it's just filled in by chunks
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+        finally:
+            os.close(fd)
         self.save()
-        self.file.close()
 
-    def _complete_upload(self):
-        file_hash = get_file_hash(self.file, self.checksum_type)
+    def _write_chunk(self, chunk, offset, blocksize, running_hash=None):
+        """ Copies `chunk` into the upload file starting at `offset`.
+
+        Returns number of bytes written.
+        """
+        self._set_file_name(chunk.name)
+        path = self.file.path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Chunk is copied with one reusable buffer, so memory usage
+        # doesn't depend on the chunk size
+        buffer = bytearray(blocksize)
+        view = memoryview(buffer)
+        written = 0
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o666)
+        try:
+            read = chunk.readinto(view)
+            while read:
+                sent = 0
+                while sent < read:
+                    sent += os.pwrite(
+                        fd, view[sent:read], offset + written + sent)
+                if running_hash is not None:
+                    running_hash.update(view[:read])
+                written += read
+                read = chunk.readinto(view)
+        finally:
+            os.close(fd)
+        return written
+
+    def _check_accepts_data(self):
+        assert self.status != self.COMPLETED, "Upload already completed"
+        assert self.status != self.VERIFYING, "Upload is being verified"
+        assert self.status != self.FAILED, "Upload failed"
+        assert not self.expired, "Upload expired"
+
+    def append_chunk(self, chunk, blocksize=1024 * 1024):
+        self._check_accepts_data()
+        assert not self.part_size, \
+            "Multipart upload accepts data only in numbered parts"
+        offset = self.offset
+        finish = False
+
+        with transaction.atomic():
+            # Upload is locked while the chunk is written, so it isn't
+            # completed meanwhile. Its file is linked to the provider
+            # once verified, so it mustn't be written after that.
+            BoxUpload.objects.select_for_update().get(pk=self.pk)
+            self.refresh_from_db()
+            self._check_accepts_data()
+            assert self.offset == offset, \
+                "Upload offset ({}) changed while chunk was received"\
+                .format(self.offset)
+            assert self.offset + chunk.size <= self.file_size, \
+                "Chunk exceeds file size specified when upload was initiated"
+
+            running_hash = running_hashes.get(self.pk)
+            try:
+                # Hash is fed only while it's in sync with the file,
+                # otherwise it's caught up on upload completion
+                written = self._write_chunk(
+                    chunk, self.offset, blocksize,
+                    running_hash
+                    if running_hash.offset == self.offset else None)
+            except Exception:
+                running_hashes.discard(self.pk)
+                raise
+
+            # Truncated chunk isn't saved, so it's sent again from
+            # the same offset, and the hash fed with it is dropped
+            if written != chunk.size:
+                running_hashes.discard(self.pk)
+            assert written == chunk.size, \
+                "Uploaded content length ({}) is less than " \
+                "specified content length ({})."\
+                .format(written, chunk.size)
+
+            self.offset += written
+            if self.offset == self.file_size:
+                # No more data is accepted, while upload is verified
+                self.status = self.VERIFYING
+                if running_hash.offset == self.file_size:
+                    # Whole file is already hashed, so upload is cheap
+                    # to finish here and workers skip it
+                    self.claimed_at = timezone.now()
+                    finish = True
+                else:
+                    # Hashing the file takes time, so it's left
+                    # for `finalize_uploads` command
+                    running_hashes.discard(self.pk)
+            else:
+                self.status = self.IN_PROGRESS
+            self.save()
+
+        if finish:
+            self.finalize(running_hash)
+
+    def write_part(self, number, chunk, blocksize=1024 * 1024):
+        """ Writes part `number` of a multipart upload.
+
+        Parts may be written in any order and in parallel,
+        upload is completed once all of them are received.
+        """
+        assert self.part_size, "Upload isn't a multipart upload"
+        self._check_accepts_data()
+        assert 1 <= number <= self.parts_count, \
+            "Part number must be between 1 and {}".format(self.parts_count)
+        assert chunk.size == self.get_part_size(number), \
+            "Part {} must be {} bytes long"\
+            .format(number, self.get_part_size(number))
+
+        with transaction.atomic():
+            # Upload is completed under the same lock, so parts aren't
+            # written into a file, which is verified or linked to provider.
+            # Received parts aren't rewritten for the same reason.
+            BoxUpload.objects.select_for_update().get(pk=self.pk)
+            self.refresh_from_db()
+            self._check_accepts_data()
+            assert not self.parts.filter(number=number).exists(), \
+                "Part {} is already received".format(number)
+
+        written = self._write_chunk(
+            chunk, (number - 1) * self.part_size, blocksize)
+        assert written == chunk.size, \
+            "Uploaded content length ({}) is less than " \
+            "specified content length ({})."\
+            .format(written, chunk.size)
+
+        with transaction.atomic():
+            # Lock the upload, so parts received at the same time
+            # see each other and upload is completed only once
+            BoxUpload.objects.select_for_update().get(pk=self.pk)
+            self.refresh_from_db()
+            self._check_accepts_data()
+            self._set_file_name(chunk.name)
+
+            BoxUploadPart.objects.update_or_create(
+                upload=self, number=number, defaults={'size': written})
+            self.offset = self.parts.aggregate(size=Sum('size'))['size']
+            if self.offset == self.file_size:
+                # Parts arrive out of order, so the file is hashed
+                # as a whole by `finalize_uploads` command
+                self.status = self.VERIFYING
+            else:
+                self.status = self.IN_PROGRESS
+            self.save()
+
+    def finalize(self, running_hash=None):
+        """ Verifies checksum of received upload and fills in its provider.
+
+        Upload is marked as failed, when checksum doesn't match.
+        """
+        self.complete(self.hash_file(running_hash))
+
+    def hash_file(self, running_hash=None):
+        """ Returns `running_hash` caught up with the whole upload file.
+
+        Reading the file takes time, so it shouldn't be done
+        while the upload is locked.
+        """
+        if running_hash is None:
+            running_hash = RunningHash()
+        try:
+            if self.part_size:
+                self._detach_file()
+            running_hash.catch_up(self.file.path, self.file_size)
+        finally:
+            running_hashes.discard(self.pk)
+        return running_hash
+
+    def _detach_file(self):
+        """ Replaces upload file with its copy, which isn't written anymore.
+
+        Parts are written without locking the upload, so a late part could
+        still change the file. Verified file is linked to the provider,
+        so the copy is verified instead. It's cheap with reflinks.
+        """
+        old_name = self.file.name
+        self.file.name = copy_file(protected_storage, old_name, old_name,
+                                   self.file.field.max_length)
+        BoxUpload.objects.filter(pk=self.pk).update(file=self.file.name)
+        protected_storage.delete(old_name)
+
+    def complete(self, running_hash):
+        """ Fills in provider of the upload hashed by `running_hash`.
+
+        Upload is marked as failed, when checksum doesn't match.
+        """
+        file_hash = running_hash.hexdigest(self.checksum_type)
+        if file_hash != self.checksum:
+            self.status = self.FAILED
+            self.save()
         assert file_hash == self.checksum, \
             "Checksum of uploaded file ({}) doesn't match " \
             "provided checksum ({}) when upload was initiated. " \
@@ -499,15 +1001,61 @@ class BoxUpload(models.Model):
             .format(file_hash, self.checksum,
                     self.get_checksum_type_display())
 
-        self._fill_in_box_provider()
+        self._fill_in_box_provider(checksums=running_hash.hexdigests())
         self.status = self.COMPLETED
         self.date_completed = timezone.now()
+        self.save()
+
+    def mount(self, source):
+        """ Completes upload with the file of `source` provider.
+
+        File is linked, so nothing has to be uploaded, when
+        the same file is already available to the user.
+        """
+        self._fill_in_box_provider(source.file.name, source.checksums)
+        self.offset = self.file_size
+        self.status = self.COMPLETED
+        self.date_completed = timezone.now()
+        self.save()
+        logger.info('Upload {} mounted from {}'.format(self, source))
+
+    def _link_box_file(self, file_name, sha256):
+        """ Links file `file_name` as the file of the provider.
+
+        Returns name of the provider file, which isn't shared with
+        other providers, so it's deleted along with the provider.
+        """
+        max_length = self.provider.file.field.max_length
+        if not (settings.BOX_STORAGE_CONTENT_ADDRESSED and sha256):
+            name = self.provider.file.field.generate_filename(
+                self.provider, file_name)
+            return link_file(protected_storage, file_name, name, max_length)
+
+        # Blobs are named by checksum computed by the server, so files
+        # declared with the same md5 or sha1 are never mixed up
+        name = blob_path(BoxProvider.SHA256, sha256)
+        stored_name = find_box_file(self.file_size, sha256)
+        if stored_name is not None:
+            try:
+                # The same file was already uploaded, so its data is
+                # linked under a new name instead of being stored again
+                return link_file(
+                    protected_storage, stored_name, name, max_length)
+            except FileNotFoundError:
+                # File was deleted along with its provider meanwhile
+                pass
+        return link_file(protected_storage, file_name, name, max_length)
+
+    def _fill_in_box_provider(self, file_name=None, checksums=None):
+        if file_name is None:
+            file_name = self.file.name
 
-    def _fill_in_box_provider(self):
         self.provider.checksum_type = self.checksum_type
         self.provider.checksum = self.checksum
+        self.provider.set_checksums(checksums or {})
         self.provider.file_size = self.file_size
-        self.provider.file.save(name=str(self.file), content=self.file)
+        self.provider.file.name = self._link_box_file(
+            file_name, self.provider.checksum_sha256)
         self.provider.status = BoxProvider.FILLED_IN
         self.provider.date_updated = timezone.now()
         self.provider.save()
@@ -519,3 +1067,92 @@ class BoxUpload(models.Model):
         Box.objects.filter(pk=self.provider.version.box_id).update(
             date_updated=self.provider.date_updated
         )
+
+
+class BoxUploadPart(models.Model):
+    upload = models.ForeignKey(
+        'BoxUpload',
+        related_name='parts',
+        on_delete=models.CASCADE,
+    )
+    number = models.PositiveIntegerField()
+    size = models.BigIntegerField()
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['number']
+        unique_together = ('upload', 'number')
+
+    def __str__(self):
+        return '{} part {}'.format(self.upload.tag, self.number)
+
+
+class BoxPull(models.Model):
+    """ Pulls of a provider saved at once.
+
+    Pulls are rolled up into `BoxDailyPulls` and deleted
+    by `rollup_pulls` command.
+    """
+    provider = models.ForeignKey(
+        'BoxProvider',
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    date_created = models.DateTimeField(default=timezone.now)
+    pulls = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return '{} pulled {} times'.format(self.provider, self.pulls)
+
+
+class BoxDailyPulls(models.Model):
+    provider = models.ForeignKey(
+        'BoxProvider',
+        related_name='daily_pulls',
+        on_delete=models.CASCADE,
+    )
+    date = models.DateField(db_index=True)
+    pulls = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('provider', 'date')
+        verbose_name_plural = 'Box daily pulls'
+
+    def __str__(self):
+        return '{} pulled {} times on {}'.format(
+            self.provider, self.pulls, self.date)
+
+
+class AccessLogPosition(models.Model):
+    """ Position up to which access log is counted in boxes pulls. """
+    path = models.CharField(max_length=255, unique=True)
+    inode = models.BigIntegerField(null=True)
+    offset = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return '{}:{}'.format(self.path, self.offset)
+
+
+class BoxMetadata(models.Model):
+    """ Box metadata document for Vagrant, rebuilt when box changes.
+
+    Download URLs are stored relative, they are completed for
+    the request, when metadata is served.
+    """
+    box = models.OneToOneField(
+        'Box',
+        primary_key=True,
+        related_name='metadata',
+        on_delete=models.CASCADE,
+    )
+    document = models.TextField()
+    # Path of the file with the document under `BOX_METADATA_ROOT`
+    static_path = models.CharField(max_length=255, blank=True)
+    date_updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'box metadata'
+
+    def __str__(self):
+        return str(self.box_id)
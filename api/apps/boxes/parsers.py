@@ -0,0 +1,60 @@
+from rest_framework.parsers import BaseParser, DataAndFiles
+
+
+class BoxUploadChunk:
+    """ Body of a chunk upload request, which isn't read in advance.
+
+    Chunk is streamed from the request into the upload file,
+    when it's appended to the upload.
+    """
+    name = 'vagrant.box'
+
+    def __init__(self, stream, size):
+        self.stream = stream
+        self.size = size
+        self._remaining = size
+
+    def readinto(self, buffer):
+        """ Reads up to `len(buffer)` bytes into `buffer`.
+
+        Returns number of bytes read, 0 at the end of the chunk.
+        """
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+
+        if hasattr(self.stream, 'readinto'):
+            read = self.stream.readinto(memoryview(buffer)[:size])
+        else:
+            # Django request provides only `read`
+            data = self.stream.read(size)
+            read = len(data)
+            buffer[:read] = data
+
+        self._remaining -= read
+        return read
+
+
+class BoxUploadParser(BaseParser):
+    """ Parser for chunks of box file uploads.
+
+    Unlike `FileUploadParser` it doesn't pass the request body through
+    Django upload handlers, so chunks aren't spooled into a temporary
+    file or memory before being written to the upload file.
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context['request']
+        meta = request.META
+        try:
+            content_length = int(
+                meta.get('CONTENT_LENGTH', meta.get('HTTP_CONTENT_LENGTH', 0))
+            )
+        except (ValueError, TypeError):
+            content_length = 0
+
+        if content_length > 0:
+            return DataAndFiles(
+                {}, {'file': BoxUploadChunk(stream, content_length)})
+        return DataAndFiles({}, {})
@@ -0,0 +1,109 @@
+import atexit
+import logging
+from collections import Counter, defaultdict
+from threading import Lock, Timer
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.boxes.models import Box, BoxProvider, BoxPull
+
+
+logger = logging.getLogger(__name__)
+
+
+class PullCounter:
+    """ Process local counter of boxes pulls.
+
+    Pulls are accumulated in memory and written to the database in
+    batches, along with `BoxPull` records of them, so concurrent
+    downloads of the same box don't wait on its row lock. Counts are
+    flushed `BOX_PULLS_FLUSH_INTERVAL` seconds after the first pull,
+    or right away, when it's 0.
+    """
+
+    def __init__(self):
+        self._counts = Counter()
+        self._lock = Lock()
+        self._timer = None
+
+    def add(self, provider_id, count=1):
+        interval = settings.BOX_PULLS_FLUSH_INTERVAL
+        with self._lock:
+            self._counts[provider_id] += count
+            if interval and self._timer is None:
+                self._timer = Timer(interval, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if not interval:
+            self.flush()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # Timer thread has its own database connection
+            connection.close()
+
+    def flush(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not counts:
+            return
+        try:
+            save_pulls(counts)
+        except DatabaseError:
+            logger.exception('Failed to save pulls, retrying later')
+            with self._lock:
+                self._counts.update(counts)
+
+
+@transaction.atomic
+def save_pulls(counts, date_created=None):
+    """ Adds pulls to providers and their boxes and records them
+    as `BoxPull`.
+
+    `counts` maps provider ids to numbers of their pulls.
+    """
+    if date_created is None:
+        date_created = timezone.now()
+
+    box_counts = Counter()
+    # Providers pulled the same number of times
+    # are updated with a single query
+    for count, provider_ids in group_by_count(counts).items():
+        providers = BoxProvider.objects.filter(pk__in=provider_ids)
+        # Date modified should not be updated
+        providers.update(pulls=F('pulls') + count)
+        # Updated providers are locked, so pulls are
+        # recorded only for ones which weren't deleted
+        pulls = []
+        for provider_id, box_id in providers.values_list(
+                'pk', 'version__box_id'):
+            pulls.append(BoxPull(provider_id=provider_id,
+                                 date_created=date_created, pulls=count))
+            box_counts[box_id] += count
+        BoxPull.objects.bulk_create(pulls)
+
+    for count, box_ids in group_by_count(box_counts).items():
+        Box.objects.filter(pk__in=box_ids).update(
+            total_pulls=F('total_pulls') + count)
+
+
+def group_by_count(counts):
+    """ Returns ids grouped by their counts in `counts`. """
+    ids_by_count = defaultdict(list)
+    for id_, count in counts.items():
+        ids_by_count[count].append(id_)
+    return ids_by_count
+
+
+pull_counter = PullCounter()
+atexit.register(pull_counter.flush)
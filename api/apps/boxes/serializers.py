@@ -1,3 +1,4 @@
+from django.conf import settings
 from rest_framework import serializers
 
 from apps.boxes.fields import (
@@ -36,11 +37,13 @@ class BoxProviderSerializer(serializers.ModelSerializer):
         }
     )
     download_url = serializers.SerializerMethodField()
+    checksums = serializers.DictField(
+        child=serializers.CharField(), read_only=True)
 
     class Meta:
         model = BoxProvider
         fields = ('url', 'tag', 'provider', 'date_created', 'date_modified',
-                  'date_updated', 'checksum_type', 'checksum',
+                  'date_updated', 'checksum_type', 'checksum', 'checksums',
                   'download_url', 'file_size', 'pulls', 'status')
 
     def get_download_url(self, obj):
@@ -65,6 +68,16 @@ class BoxVersionSerializer(serializers.ModelSerializer):
         fields = ('url', 'tag', 'date_created', 'date_modified', 'date_updated',
                   'version', 'changes', 'providers',)
 
+    def validate_version(self, value):
+        # Numbers of the version have to fit into its components fields
+        try:
+            BoxVersion.parse_version(value)
+        except ValueError:
+            raise serializers.ValidationError(
+                'Invalid version number. X, Y, and Z must not be greater '
+                'than {}.'.format(BoxVersion.VERSION_COMPONENT_MAX))
+        return value
+
 
 class BoxVersionSimpleSerializer(serializers.ModelSerializer):
     url = MultiLookupHyperlinkedIdentityField(
@@ -132,7 +145,19 @@ class BoxProviderMetadataSerializer(serializers.ModelSerializer):
         fields = ('name', 'url', 'checksum_type', 'checksum',)
 
     def get_download_url(self, obj):
-        return self.context.get('request').build_absolute_uri(obj.download_url)
+        request = self.context.get('request')
+        if request is None:
+            # Stored metadata document, URL is completed when it's served
+            return obj.download_url
+        url = obj.get_secure_download_url() or obj.download_url
+        return request.build_absolute_uri(url)
+
+
+class BoxResolveSerializer(BoxProviderMetadataSerializer):
+    version = serializers.CharField(source='version.version', read_only=True)
+
+    class Meta(BoxProviderMetadataSerializer.Meta):
+        fields = ('version', ) + BoxProviderMetadataSerializer.Meta.fields
 
 
 class BoxVersionMetadataSerializer(serializers.ModelSerializer):
@@ -147,12 +172,25 @@ class BoxMetadataSerializer(serializers.ModelSerializer):
     name = serializers.CharField(source='tag', read_only=True)
     description = serializers.CharField(
         source='short_description', read_only=True)
-    versions = BoxVersionMetadataSerializer(many=True, read_only=True)
+    versions = serializers.SerializerMethodField()
 
     class Meta:
         model = Box
         fields = ('name', 'description', 'versions',)
 
+    def get_versions(self, obj):
+        # Versions may be limited by the view
+        versions = self.context.get('versions')
+        if versions is None:
+            versions = obj.versions.all()
+        return BoxVersionMetadataSerializer(
+            versions, many=True, context=self.context).data
+
+
+class BoxPullsSerializer(serializers.Serializer):
+    date = serializers.DateField(read_only=True)
+    pulls = serializers.IntegerField(read_only=True)
+
 
 class BoxUploadSerializer(serializers.ModelSerializer):
     url = MultiLookupHyperlinkedIdentityField(
@@ -171,13 +209,30 @@ class BoxUploadSerializer(serializers.ModelSerializer):
     date_expires = serializers.ReadOnlyField(source='expires')
     file_size = serializers.IntegerField(required=True)
     offset = serializers.ReadOnlyField()
+    received_parts = serializers.SerializerMethodField()
 
     class Meta:
         model = BoxUpload
         fields = ('url', 'id', 'user', 'date_created', 'date_modified',
                   'date_completed', 'date_expires', 'file_size', 'offset',
-                  'status', 'tag', 'checksum_type', 'checksum', )
+                  'status', 'tag', 'checksum_type', 'checksum',
+                  'part_size', 'received_parts', )
         lookup_field = 'checksum'
         extra_kwargs = {
-            'url': {'lookup_field': 'checksum'}
+            'url': {'lookup_field': 'checksum'},
         }
+
+    def validate_part_size(self, value):
+        if value is not None and not (
+                settings.BOX_UPLOAD_MIN_PART_SIZE <= value
+                <= settings.BOX_UPLOAD_MAX_PART_SIZE):
+            raise serializers.ValidationError(
+                'Ensure this value is between {} and {}.'.format(
+                    settings.BOX_UPLOAD_MIN_PART_SIZE,
+                    settings.BOX_UPLOAD_MAX_PART_SIZE))
+        return value
+
+    def get_received_parts(self, obj):
+        if not obj.part_size:
+            return []
+        return [part.number for part in obj.parts.all()]
@@ -1,7 +1,13 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from apps.boxes.models import BoxUpload, BoxProvider, BoxVersion, Box
+from apps.boxes.metadata import delete_static_metadata, rebuild_metadata
+from apps.boxes.models import (
+    Box, BoxMember, BoxMetadata, BoxProvider, BoxUpload, BoxVersion)
 
 
 @receiver(post_delete, sender=BoxUpload,
@@ -11,6 +17,35 @@ def box_upload_delete_handler(sender, instance, **kwargs):
     instance.file.delete(False)
 
 
+@receiver(post_delete, sender=BoxProvider,
+          dispatch_uid='box_provider_delete_handler')
+def box_provider_delete_handler(sender, instance, **kwargs):
+    if not instance.file:
+        return
+
+    name = instance.file.name
+    storage = instance.file.storage
+
+    def delete_unreferenced_file():
+        # Providers get files under their own names, linked to shared
+        # blobs, but files stored before could be shared by name,
+        # so file is deleted only with the last provider using it
+        if not BoxProvider.objects.filter(file=name).exists():
+            storage.delete(name)
+
+    transaction.on_commit(delete_unreferenced_file)
+
+
+@receiver(post_delete, sender=BoxProvider,
+          dispatch_uid='box_provider_pulls_delete_handler')
+def box_provider_pulls_delete_handler(sender, instance, **kwargs):
+    # Box may be already deleted, then nothing is updated
+    if instance.pulls:
+        Box.objects.filter(versions=instance.version_id).update(
+            total_pulls=Greatest(F('total_pulls') - instance.pulls, 0)
+        )
+
+
 @receiver(post_save, sender=BoxProvider,
           dispatch_uid='box_provider_date_updated_handler')
 def box_provider_date_updated_handler(sender, instance, raw, created, **kwargs):
@@ -30,3 +65,63 @@ def box_version_date_updated_handler(sender, instance, raw, created, **kwargs):
         Box.objects.filter(pk=instance.box_id).update(
             date_updated=instance.date_updated
         )
+
+
+@receiver(post_save, sender=BoxVersion,
+          dispatch_uid='box_version_date_modified_save_handler')
+@receiver(post_delete, sender=BoxVersion,
+          dispatch_uid='box_version_date_modified_delete_handler')
+@receiver(post_save, sender=BoxMember,
+          dispatch_uid='box_member_date_modified_save_handler')
+@receiver(post_delete, sender=BoxMember,
+          dispatch_uid='box_member_date_modified_delete_handler')
+def box_date_modified_handler(sender, instance, **kwargs):
+    # Versions and members are a part of box details,
+    # which are validated by box modification date
+    if not kwargs.get('raw'):
+        Box.objects.filter(pk=instance.box_id).update(
+            date_modified=timezone.now()
+        )
+
+
+@receiver(post_save, sender=Box, dispatch_uid='box_metadata_box_handler')
+def box_metadata_box_handler(sender, instance, raw, **kwargs):
+    if not raw:
+        rebuild_metadata(instance.pk)
+
+
+@receiver(post_save, sender=BoxVersion,
+          dispatch_uid='box_metadata_version_save_handler')
+@receiver(post_delete, sender=BoxVersion,
+          dispatch_uid='box_metadata_version_delete_handler')
+def box_metadata_version_handler(sender, instance, **kwargs):
+    if not kwargs.get('raw'):
+        # Document isn't created on delete, as it may be
+        # deleted already along with the box
+        rebuild_metadata(instance.box_id,
+                         create=kwargs['signal'] is post_save)
+
+
+@receiver(post_save, sender=BoxProvider,
+          dispatch_uid='box_metadata_provider_save_handler')
+@receiver(post_delete, sender=BoxProvider,
+          dispatch_uid='box_metadata_provider_delete_handler')
+def box_metadata_provider_handler(sender, instance, **kwargs):
+    if kwargs.get('raw'):
+        return
+    # Version may be already deleted along with the box
+    box_id = (BoxVersion.objects
+              .filter(pk=instance.version_id)
+              .values_list('box_id', flat=True)
+              .first())
+    if box_id is not None:
+        rebuild_metadata(box_id, create=kwargs['signal'] is post_save)
+
+
+@receiver(post_delete, sender=BoxMetadata,
+          dispatch_uid='box_metadata_delete_handler')
+def box_metadata_delete_handler(sender, instance, **kwargs):
+    if instance.static_path:
+        static_path = instance.static_path
+        transaction.on_commit(
+            lambda: delete_static_metadata(static_path))
@@ -1,13 +1,26 @@
+import errno
+import hashlib
+import os
+import time
+from datetime import timedelta
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
 from django.db import transaction
+from django.test import override_settings
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import (
     APITestCase, APIRequestFactory, force_authenticate)
 
 from apps.boxes.api_views import BoxViewSet
-from apps.boxes.models import BoxUpload, Box, BoxMember, BoxProvider
+from apps.boxes.metadata import create_metadata
+from apps.boxes.models import (
+    BoxUpload, BoxUploadPart, Box, BoxMember, BoxProvider, BoxDailyPulls)
+from apps.boxes.utils import get_secure_link_hash
 from apps.factories import (
     BoxUploadFactory, BoxProviderFactory, StaffFactory, UserFactory,
-    BoxFactory, BoxVersionFactory, EmptyBoxProviderFactory)
+    BoxFactory, BoxVersionFactory, EmptyBoxProviderFactory, FILE_CONTENT)
 from vagrant_registry import urls
 
 
@@ -34,6 +47,44 @@ class BoxViewSetTestCase(APITestCase):
         self.assertEqual(response.data['count'], 1)
         self.assertEqual(response.data['results'][0]['name'], b2.name)
 
+    def test_boxes_shared_with_many_members_listed_once(self):
+        user = UserFactory()
+        other_users = [UserFactory() for _ in range(3)]
+        boxes = [BoxFactory(visibility=Box.PRIVATE) for _ in range(8)]
+        # Visible to the user in several ways at once
+        boxes += [BoxFactory(visibility=Box.PUBLIC, owner=user)
+                  for _ in range(4)]
+        for box in boxes:
+            box.share_with(user, BoxMember.PERM_R)
+            for other_user in other_users:
+                box.share_with(other_user, BoxMember.PERM_RW)
+
+        names = []
+        for page in (1, 2):
+            request = self.factory.get('/url/', {'page': page})
+            force_authenticate(request, user=user)
+            response = self.view(request)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['count'], len(boxes))
+            names += [b['name'] for b in response.data['results']]
+
+        self.assertEqual(len(names), len(boxes))
+        self.assertEqual(sorted(names), sorted(box.name for box in boxes))
+
+    def test_boxes_ordered_by_pulls(self):
+        boxes = [BoxFactory(visibility=Box.PUBLIC) for _ in range(3)]
+        for pulls, box in zip((5, 20, 1), boxes):
+            Box.objects.filter(pk=box.pk).update(total_pulls=pulls)
+
+        request = self.factory.get('/url/')
+        response = self.view(request)
+
+        self.assertEqual(
+            [(b['name'], b['pulls']) for b in response.data['results']],
+            [(boxes[1].name, 20), (boxes[0].name, 5), (boxes[2].name, 1)]
+        )
+
 
 class UserBoxViewSetTestCase(APITestCase):
 
@@ -131,6 +182,59 @@ class UserBoxViewSetTestCase(APITestCase):
         self.assertEqual(Box.objects.count(), 0)
 
 
+    def test_box_detail_not_modified(self):
+        user = UserFactory()
+        box = BoxFactory(owner=user)
+        BoxVersionFactory(box=box)
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=user)
+        response = self.view_detail(request, username=user.username,
+                                    box_name=box.name)
+        etag = response['ETag']
+
+        request = self.factory.get('/url/', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=user)
+        with self.assertNumQueries(1):
+            response = self.view_detail(request, username=user.username,
+                                        box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_box_detail_modified_with_versions(self):
+        user = UserFactory()
+        box = BoxFactory(owner=user)
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=user)
+        response = self.view_detail(request, username=user.username,
+                                    box_name=box.name)
+        etag = response['ETag']
+
+        BoxVersionFactory(box=box)
+        request = self.factory.get('/url/', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=user)
+        response = self.view_detail(request, username=user.username,
+                                    box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['versions']), 1)
+
+    def test_box_detail_etag_depends_on_user(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=box.owner)
+        response = self.view_detail(request, username=box.owner.username,
+                                    box_name=box.name)
+
+        request = self.factory.get('/url/',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        response = self.view_detail(request, username=box.owner.username,
+                                    box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
 class UserBoxMemberViewSetTestCase(APITestCase):
 
     def setUp(self):
@@ -241,6 +345,20 @@ class UserBoxVersionViewSetTestCase(APITestCase):
         self.view_list = urls.box_version_list
         self.view_detail = urls.box_version_detail
 
+    def test_versions_ordered_by_version(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        for version in ('1.9.0', '1.10.0', '1.2.0'):
+            BoxVersionFactory(box=box, version=version)
+
+        request = self.factory.get('/url/')
+        response = self.view_list(request, username=box.owner.username,
+                                  box_name=box.name)
+
+        self.assertEqual(
+            [v['version'] for v in response.data['results']],
+            ['1.10.0', '1.9.0', '1.2.0']
+        )
+
     def test_box_owner_can_create_version(self):
         user = UserFactory()
         box = BoxFactory(owner=user)
@@ -259,6 +377,19 @@ class UserBoxVersionViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue(box.versions.filter(**data).exists())
 
+    def test_version_with_too_large_number_not_created(self):
+        box = BoxFactory()
+
+        request = self.factory.post('/url/', data={'version': '1.99999999999'})
+        force_authenticate(request, user=box.owner)
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('version', response.data)
+
     def test_user_with_permissions_can_create_version(self):
         user = UserFactory()
         box = BoxFactory()
@@ -296,6 +427,68 @@ class UserBoxVersionViewSetTestCase(APITestCase):
         self.assertEqual(response.data['count'], 2)
 
 
+class BoxResolveViewSetTestCase(APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = urls.box_resolve
+        self.box = BoxFactory(visibility=Box.PUBLIC)
+        for version in ('1.9.0', '2.0.0', '2.10.1', '3.0.0'):
+            version = BoxVersionFactory(box=self.box, version=version)
+            for provider in ('virtualbox', 'vmware'):
+                BoxProviderFactory(version=version, provider=provider)
+        # Not uploaded yet
+        EmptyBoxProviderFactory(version__box=self.box,
+                                version__version='3.1.0')
+
+    def resolve(self, **params):
+        request = self.factory.get('/url/', params)
+        return self.view(request, username=self.box.owner.username,
+                         box_name=self.box.name)
+
+    def test_latest_version(self):
+        with self.assertNumQueries(1):
+            response = self.resolve()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        provider = BoxProvider.objects.get(
+            version__box=self.box, version__version='3.0.0',
+            provider='virtualbox')
+        self.assertEqual(response.data, {
+            'version': '3.0.0',
+            'name': 'virtualbox',
+            'url': 'http://testserver' + provider.download_url,
+            'checksum_type': provider.checksum_type,
+            'checksum': provider.checksum,
+        })
+
+    def test_version_satisfying_constraint(self):
+        response = self.resolve(constraint='>= 2.0, < 3.0', provider='vmware')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['version'], '2.10.1')
+        self.assertEqual(response.data['name'], 'vmware')
+
+    def test_no_version_satisfying_constraint(self):
+        response = self.resolve(constraint='~> 4.0')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invalid_constraint(self):
+        response = self.resolve(constraint='>= two')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('constraint', response.data)
+
+    def test_private_box_not_found(self):
+        self.box.visibility = Box.PRIVATE
+        self.box.save()
+
+        response = self.resolve()
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class UserBoxProviderViewSetTestCase(APITestCase):
 
     def setUp(self):
@@ -380,6 +573,331 @@ class UserBoxMetadataViewSetTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_metadata_document_served(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        provider = BoxProviderFactory(version__box=box)
+        request = self.factory.get('/url/')
+        self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        with self.assertNumQueries(1):
+            response = self.view_detail(
+                request,
+                username=box.owner.username,
+                box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'name': box.tag,
+            'description': box.short_description,
+            'versions': [{
+                'version': provider.version.version,
+                'providers': [{
+                    'name': provider.provider,
+                    'url': 'http://testserver' + provider.download_url,
+                    'checksum_type': provider.checksum_type,
+                    'checksum': provider.checksum,
+                }],
+            }],
+        })
+
+    def test_metadata_document_rebuilt_on_box_changes(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        version = BoxVersionFactory(box=box)
+        request = self.factory.get('/url/')
+        self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        provider = BoxProviderFactory(version=version)
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+        self.assertEqual(
+            response.data['versions'][0]['providers'][0]['name'],
+            provider.provider)
+
+        version.delete()
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+        self.assertEqual(response.data['versions'], [])
+
+    def test_metadata_not_modified(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        BoxProviderFactory(version__box=box)
+        request = self.factory.get('/url/')
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+        self.assertTrue(response['ETag'].startswith('"'))
+
+        for headers in ({'HTTP_IF_NONE_MATCH': response['ETag']},
+                        {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}):
+            request = self.factory.get('/url/', **headers)
+            with self.assertNumQueries(1):
+                response = self.view_detail(
+                    request,
+                    username=box.owner.username,
+                    box_name=box.name)
+            self.assertEqual(response.status_code,
+                             status.HTTP_304_NOT_MODIFIED)
+
+    def test_metadata_modified_after_rebuild(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        version = BoxVersionFactory(box=box)
+        request = self.factory.get('/url/')
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+        etag = response['ETag']
+
+        BoxProviderFactory(version=version)
+        request = self.factory.get('/url/', HTTP_IF_NONE_MATCH=etag)
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data['versions'][0]['providers']), 1)
+
+    def test_metadata_of_latest_versions(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        for version in ('1.9.0', '1.10.0', '1.10.1', '2.0.0'):
+            BoxProviderFactory(version__box=box, version__version=version)
+
+        for params, versions in (
+                ({'limit': 2}, ['2.0.0', '1.10.1']),
+                ({'newer_than': '1.9.0'}, ['2.0.0', '1.10.1', '1.10.0']),
+                ({'newer_than': '1.9.0', 'limit': 2}, ['2.0.0', '1.10.1'])):
+            request = self.factory.get('/url/', params)
+            # Box, versions and their providers
+            with self.assertNumQueries(3):
+                response = self.view_detail(
+                    request,
+                    username=box.owner.username,
+                    box_name=box.name)
+
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['name'], box.tag)
+            self.assertEqual(
+                [v['version'] for v in response.data['versions']], versions)
+            self.assertTrue(
+                response.data['versions'][0]['providers'][0]['url']
+                .startswith('http://testserver/'))
+
+    def test_metadata_of_latest_versions_invalid_params(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+
+        for params in ({'limit': 0}, {'limit': 'all'},
+                       {'newer_than': 'latest'}):
+            request = self.factory.get('/url/', params)
+            response = self.view_detail(
+                request,
+                username=box.owner.username,
+                box_name=box.name)
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_400_BAD_REQUEST)
+            self.assertIn(list(params)[0], response.data)
+
+    def test_private_box_metadata_not_found(self):
+        box = BoxFactory(visibility=Box.PRIVATE)
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=box.owner)
+        self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=UserFactory())
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(SECURE_DOWNLOADS_SECRET='secret')
+    def test_metadata_links_to_signed_downloads(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        provider = BoxProviderFactory(version__box=box)
+
+        request = self.factory.get('/url/')
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        url = urlparse(response.data['versions'][0]['providers'][0]['url'])
+        query = parse_qs(url.query)
+        self.assertEqual(
+            url.path,
+            '/secure-downloads/{}/{}'.format(provider.pk, provider.file.name))
+        self.assertEqual(
+            query['md5'][0],
+            get_secure_link_hash(url.path, query['expires'][0], 'secret'))
+        self.assertGreater(int(query['expires'][0]), time.time())
+
+    def test_metadata_links_to_downloads_without_secret(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        provider = BoxProviderFactory(version__box=box)
+
+        request = self.factory.get('/url/')
+        response = self.view_detail(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        self.assertEqual(
+            response.data['versions'][0]['providers'][0]['url'],
+            'http://testserver' + provider.download_url)
+
+
+class BoxMetadataBulkViewSetTestCase(APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = urls.box_metadata_bulk
+
+    def test_metadata_of_boxes(self):
+        user = UserFactory()
+        provider1 = BoxProviderFactory(version__box__visibility=Box.PUBLIC)
+        provider2 = BoxProviderFactory(version__box__visibility=Box.PRIVATE)
+        provider2.box.share_with(user, BoxMember.PERM_R)
+        private_box = BoxFactory(visibility=Box.PRIVATE)
+        tags = [provider1.box.tag, provider2.box.tag, private_box.tag,
+                'missing/box', 'invalid']
+
+        request = self.factory.get('/url/', {'boxes': ','.join(tags)})
+        force_authenticate(request, user=user)
+        response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data), tags)
+        self.assertEqual(
+            response.data[provider1.box.tag]['versions'][0]['providers'][0],
+            {
+                'name': provider1.provider,
+                'url': 'http://testserver' + provider1.download_url,
+                'checksum_type': provider1.checksum_type,
+                'checksum': provider1.checksum,
+            })
+        self.assertEqual(response.data[provider2.box.tag]['name'],
+                         provider2.box.tag)
+        self.assertIsNone(response.data[private_box.tag])
+        self.assertIsNone(response.data['missing/box'])
+        self.assertIsNone(response.data['invalid'])
+
+    @override_settings(SECURE_DOWNLOADS_SECRET='secret')
+    def test_number_of_queries_does_not_depend_on_boxes(self):
+        boxes = [BoxProviderFactory(version__box__visibility=Box.PUBLIC).box
+                 for _ in range(4)]
+        create_metadata(boxes[0])
+
+        for count in (2, 4):
+            tags = ','.join(box.tag for box in boxes[:count])
+            request = self.factory.get('/url/', {'boxes': tags})
+            # Boxes with metadata, boxes without it with
+            # their versions and providers, signed URLs
+            with self.assertNumQueries(5):
+                response = self.view(request)
+            self.assertEqual(len(response.data), count)
+
+    def test_too_many_boxes(self):
+        tags = ','.join('user/box{}'.format(i) for i in range(101))
+        request = self.factory.get('/url/', {'boxes': tags})
+        response = self.view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserBoxPullsViewSetTestCase(APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view_list = urls.box_pulls_list
+
+    def test_user_with_permissions_can_view_box_pulls(self):
+        user = UserFactory()
+        box = BoxFactory()
+        box.share_with(user, BoxMember.PERM_R)
+        version1 = BoxVersionFactory(box=box)
+        version2 = BoxVersionFactory(box=box)
+        provider1 = BoxProviderFactory(version=version1)
+        provider2 = BoxProviderFactory(version=version2)
+        today = timezone.now().date()
+        BoxDailyPulls.objects.create(provider=provider1, date=today, pulls=1)
+        BoxDailyPulls.objects.create(provider=provider2, date=today, pulls=2)
+        BoxDailyPulls.objects.create(
+            provider=BoxProviderFactory(), date=today, pulls=10)
+
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=user)
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'date': str(today), 'pulls': 3},
+        ])
+
+    def test_version_pulls(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        version1 = BoxVersionFactory(box=box)
+        version2 = BoxVersionFactory(box=box)
+        today = timezone.now().date()
+        BoxDailyPulls.objects.create(
+            provider=BoxProviderFactory(
+                version=version1, provider='virtualbox'),
+            date=today - timedelta(days=1),
+            pulls=1)
+        BoxDailyPulls.objects.create(
+            provider=BoxProviderFactory(version=version1, provider='vmware'),
+            date=today,
+            pulls=2)
+        BoxDailyPulls.objects.create(
+            provider=BoxProviderFactory(version=version2),
+            date=today,
+            pulls=4)
+
+        request = self.factory.get('/url/')
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name,
+            version=version1.version)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'date': str(today), 'pulls': 2},
+            {'date': str(today - timedelta(days=1)), 'pulls': 1},
+        ])
+
+    def test_private_box_pulls_not_found(self):
+        box = BoxFactory(visibility=Box.PRIVATE)
+
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=UserFactory())
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 
 class UserBoxUploadViewSetTestCase(APITestCase):
 
@@ -436,6 +954,84 @@ class UserBoxUploadViewSetTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue(box_provider.uploads.filter(**data).exists())
 
+    def initiate_upload(self, user, box_provider, data):
+        request = self.factory.post('/url/', data=data)
+        force_authenticate(request, user=user)
+        return self.view_list(
+            request,
+            username=box_provider.version.box.owner.username,
+            box_name=box_provider.version.box.name,
+            version=box_provider.version.version,
+            provider=box_provider.provider,
+        )
+
+    @override_settings(BOX_UPLOAD_MIN_PART_SIZE=5,
+                       BOX_UPLOAD_MAX_PART_SIZE=10)
+    def test_upload_part_size_limited(self):
+        user = UserFactory()
+        box_provider = EmptyBoxProviderFactory(version__box__owner=user)
+
+        for part_size, status_code in (
+                (4, status.HTTP_400_BAD_REQUEST),
+                (11, status.HTTP_400_BAD_REQUEST),
+                (5, status.HTTP_201_CREATED)):
+            data = {
+                'file_size': 100,
+                'checksum_type': BoxProvider.SHA256,
+                'checksum': 'asdf{}'.format(part_size),
+                'part_size': part_size,
+            }
+            response = self.initiate_upload(user, box_provider, data)
+
+            self.assertEqual(response.status_code, status_code)
+
+    def test_upload_file_preallocated(self):
+        user = UserFactory()
+        box_provider = EmptyBoxProviderFactory(version__box__owner=user)
+
+        response = self.initiate_upload(user, box_provider, {
+            'file_size': 100,
+            'checksum_type': BoxProvider.SHA256,
+            'checksum': 'asdf',
+        })
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload = box_provider.uploads.get()
+        self.assertEqual(os.path.getsize(upload.file.path), 100)
+        self.assertEqual(upload.offset, 0)
+
+    def test_upload_rejected_when_disk_is_full(self):
+        user = UserFactory()
+        box_provider = EmptyBoxProviderFactory(version__box__owner=user)
+
+        with patch('os.posix_fallocate',
+                   side_effect=OSError(errno.ENOSPC, 'No space left')):
+            response = self.initiate_upload(user, box_provider, {
+                'file_size': 100,
+                'checksum_type': BoxProvider.SHA256,
+                'checksum': 'asdf',
+            })
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_507_INSUFFICIENT_STORAGE)
+        self.assertFalse(box_provider.uploads.exists())
+
+    def test_upload_rejected_when_space_is_reserved(self):
+        user = UserFactory()
+        box_provider = EmptyBoxProviderFactory(version__box__owner=user)
+        BoxUploadFactory(file_size=100, offset=40)
+
+        with patch('apps.boxes.api_views.get_free_space', return_value=100):
+            response = self.initiate_upload(user, box_provider, {
+                'file_size': 50,
+                'checksum_type': BoxProvider.SHA256,
+                'checksum': 'asdf',
+            })
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_507_INSUFFICIENT_STORAGE)
+        self.assertFalse(box_provider.uploads.exists())
+
     def test_user_with_permissions_can_view_uploads(self):
         user = UserFactory()
         box = BoxFactory()
@@ -482,6 +1078,94 @@ class UserBoxUploadViewSetTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_upload_of_readable_file_completed_at_once(self):
+        user = UserFactory()
+        source = BoxProviderFactory(version__box__visibility=Box.PUBLIC)
+        box = BoxFactory(owner=user)
+        box_version = BoxVersionFactory(box=box)
+        box_provider = EmptyBoxProviderFactory(version=box_version)
+
+        data = {
+            'file_size': source.file_size,
+            'checksum_type': source.checksum_type,
+            'checksum': source.checksum,
+        }
+        request = self.factory.post('/url/', data=data)
+        force_authenticate(request, user=user)
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name,
+            version=box_version.version,
+            provider=box_provider.provider,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], BoxUpload.COMPLETED)
+        box_provider.refresh_from_db()
+        self.assertEqual(box_provider.status, BoxProvider.FILLED_IN)
+        self.assertEqual(box_provider.file.read(), source.file.read())
+
+    def test_upload_of_file_declared_with_other_checksum_type_mounted(self):
+        user = UserFactory()
+        source = BoxProviderFactory(
+            version__box__visibility=Box.PUBLIC,
+            checksum_type=BoxProvider.MD5,
+            checksum=hashlib.md5(FILE_CONTENT).hexdigest())
+        box = BoxFactory(owner=user)
+        box_version = BoxVersionFactory(box=box)
+        box_provider = EmptyBoxProviderFactory(version=box_version)
+
+        data = {
+            'file_size': source.file_size,
+            'checksum_type': BoxProvider.SHA256,
+            'checksum': source.checksum_sha256,
+        }
+        request = self.factory.post('/url/', data=data)
+        force_authenticate(request, user=user)
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name,
+            version=box_version.version,
+            provider=box_provider.provider,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], BoxUpload.COMPLETED)
+        box_provider.refresh_from_db()
+        self.assertEqual(box_provider.status, BoxProvider.FILLED_IN)
+        self.assertEqual(box_provider.checksum_type, BoxProvider.SHA256)
+        self.assertEqual(box_provider.checksum, source.checksum_sha256)
+        self.assertEqual(box_provider.file.read(), source.file.read())
+
+    def test_upload_of_not_readable_file_not_completed(self):
+        user = UserFactory()
+        source = BoxProviderFactory(version__box__visibility=Box.PRIVATE)
+        box = BoxFactory(owner=user)
+        box_version = BoxVersionFactory(box=box)
+        box_provider = EmptyBoxProviderFactory(version=box_version)
+
+        data = {
+            'file_size': source.file_size,
+            'checksum_type': source.checksum_type,
+            'checksum': source.checksum,
+        }
+        request = self.factory.post('/url/', data=data)
+        force_authenticate(request, user=user)
+        response = self.view_list(
+            request,
+            username=box.owner.username,
+            box_name=box.name,
+            version=box_version.version,
+            provider=box_provider.provider,
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], BoxUpload.STARTED)
+        box_provider.refresh_from_db()
+        self.assertEqual(box_provider.status, BoxProvider.EMPTY)
+
 
 class UserBoxUploadHandlerViewSetTestCase(APITestCase):
 
@@ -666,3 +1350,139 @@ class UserBoxUploadHandlerViewSetTestCase(APITestCase):
 
         self.assertEqual(box_upload.provider.file.read(), file_data)
 
+
+    def test_off_by_one_last_byte_position_not_accepted(self):
+        file_data, file_len = self.get_file_length('Ї12\n345\t6789')
+        bu_factory = BoxUploadFactory(
+            provider__version__box__owner=self.user,
+            file_content=file_data,
+        )
+
+        # Last byte position is inclusive, so neither the exclusive
+        # position nor the one before the last byte are accepted
+        for content_range in ((0, file_len, file_len),
+                              (0, file_len - 2, file_len)):
+            request = self.get_request(file_data, content_range)
+            response = self.get_response(request, bu_factory)
+
+            self.assertEqual(response.status_code,
+                             status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+
+        box_upload = BoxUpload.objects.get(pk=bu_factory.pk)
+        self.assertEqual(box_upload.offset, 0)
+        self.assertEqual(box_upload.status, BoxUpload.STARTED)
+
+    def test_off_by_one_chunk_length_reported(self):
+        file_data, file_len = self.get_file_length('test content')
+        bu_factory = BoxUploadFactory(
+            provider__version__box__owner=self.user,
+            file_content=file_data,
+        )
+
+        request = self.get_request(file_data[:5], (0, 5, file_len))
+        response = self.get_response(request, bu_factory)
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertIn('(5)', response.data['detail'])
+        self.assertIn('(6)', response.data['detail'])
+
+
+class UserBoxUploadPartViewSetTestCase(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = StaffFactory()
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = urls.box_upload_part_detail
+
+    def get_response(self, data, bu_factory, part_number):
+        request = self.factory.put(
+            '/url/', data, content_type='application/octet-stream')
+        force_authenticate(request, user=bu_factory.box.owner)
+        return self.view(
+            request,
+            username=bu_factory.box.owner.username,
+            box_name=bu_factory.box.name,
+            version=bu_factory.version.version,
+            provider=bu_factory.provider.provider,
+            checksum=bu_factory.checksum,
+            part_number=part_number,
+        )
+
+    def test_box_uploaded_in_parts_out_of_order(self):
+        file_data = b'test content'
+        bu_factory = BoxUploadFactory(provider__version__box__owner=self.user,
+                                      file_content=file_data, part_size=5)
+
+        for number in (3, 1):
+            response = self.get_response(
+                file_data[(number - 1) * 5:number * 5], bu_factory, number)
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['received_parts'], [1, 3])
+
+        response = self.get_response(file_data[5:10], bu_factory, 2)
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], BoxUpload.VERIFYING)
+
+        box_upload = BoxUpload.objects.get(pk=bu_factory.pk)
+        self.assertEqual(box_upload.offset, len(file_data))
+        box_upload.finalize()
+        self.assertEqual(box_upload.status, BoxUpload.COMPLETED)
+        self.assertEqual(box_upload.provider.file.read(), file_data)
+
+    def test_part_with_invalid_number_not_accepted(self):
+        bu_factory = BoxUploadFactory(provider__version__box__owner=self.user,
+                                      file_content=b'test content',
+                                      part_size=5)
+
+        response = self.get_response(b'tests', bu_factory, 4)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_part_with_invalid_size_not_accepted(self):
+        bu_factory = BoxUploadFactory(provider__version__box__owner=self.user,
+                                      file_content=b'test content',
+                                      part_size=5)
+
+        response = self.get_response(b'test', bu_factory, 1)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(BoxUpload.objects.get(pk=bu_factory.pk).parts.exists())
+
+    def test_received_part_not_rewritten(self):
+        bu_factory = BoxUploadFactory(provider__version__box__owner=self.user,
+                                      file_content=b'test content',
+                                      part_size=5)
+        self.get_response(b'test ', bu_factory, 1)
+
+        response = self.get_response(b'poop ', bu_factory, 1)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        box_upload = BoxUpload.objects.get(pk=bu_factory.pk)
+        self.assertEqual(box_upload.file.read(5), b'test ')
+
+    def test_part_not_written_to_verifying_upload(self):
+        file_data = b'test content'
+        bu_factory = BoxUploadFactory(provider__version__box__owner=self.user,
+                                      file_content=file_data, part_size=5)
+        for number in (1, 2, 3):
+            self.get_response(
+                file_data[(number - 1) * 5:number * 5], bu_factory, number)
+        BoxUploadPart.objects.filter(upload=bu_factory, number=2).delete()
+
+        response = self.get_response(b'poops', bu_factory, 2)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        box_upload = BoxUpload.objects.get(pk=bu_factory.pk)
+        self.assertEqual(box_upload.file.read(), file_data)
+
+    def test_part_not_accepted_by_sequential_upload(self):
+        bu_factory = BoxUploadFactory(provider__version__box__owner=self.user,
+                                      file_content=b'test content')
+
+        response = self.get_response(b'tests', bu_factory, 1)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
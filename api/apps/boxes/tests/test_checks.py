@@ -0,0 +1,22 @@
+from django.test import SimpleTestCase, override_settings
+
+from apps.boxes.checks import check_secure_downloads_counted
+
+
+class SecureDownloadsCountedCheckTestCase(SimpleTestCase):
+
+    @override_settings(SECURE_DOWNLOADS_SECRET='secret',
+                       BOX_PULLS_FROM_ACCESS_LOG=False)
+    def test_error_when_pulls_not_counted_from_access_log(self):
+        errors = check_secure_downloads_counted(None)
+
+        self.assertEqual([e.id for e in errors], ['boxes.E001'])
+
+    @override_settings(SECURE_DOWNLOADS_SECRET='secret',
+                       BOX_PULLS_FROM_ACCESS_LOG=True)
+    def test_no_error_when_pulls_counted_from_access_log(self):
+        self.assertEqual(check_secure_downloads_counted(None), [])
+
+    @override_settings(SECURE_DOWNLOADS_SECRET='')
+    def test_no_error_without_secure_downloads(self):
+        self.assertEqual(check_secure_downloads_counted(None), [])
@@ -0,0 +1,367 @@
+import hashlib
+import os
+import tempfile
+from datetime import date, timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.boxes.management.commands import finalize_uploads, rollup_pulls
+from apps.boxes.models import (
+    AccessLogPosition, Box, BoxUpload, BoxProvider, BoxPull, BoxDailyPulls,
+    blob_path)
+from apps.factories import BoxUploadFactory, BoxProviderFactory, FILE_CONTENT
+
+
+class FinalizeUploadsCommandTestCase(TestCase):
+
+    def get_verifying_upload(self, file_content, data):
+        bu = BoxUploadFactory(file_content=file_content, part_size=2)
+        for number in range(1, bu.parts_count + 1):
+            part = data[(number - 1) * 2:number * 2]
+            f = BytesIO(part)
+            f.size = len(part)
+            f.name = 'test.box'
+            bu.write_part(number, f)
+        self.assertEqual(bu.status, BoxUpload.VERIFYING)
+        return bu
+
+    def test_verifying_uploads_completed(self):
+        bu = self.get_verifying_upload(b'test', b'test')
+
+        call_command('finalize_uploads', stdout=StringIO())
+
+        bu.refresh_from_db()
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        self.assertEqual(bu.provider.status, BoxProvider.FILLED_IN)
+
+    def test_uploads_with_invalid_checksum_failed(self):
+        bu = self.get_verifying_upload(b'test', b'poop')
+
+        call_command('finalize_uploads', stdout=StringIO())
+
+        bu.refresh_from_db()
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.FAILED)
+        self.assertEqual(bu.provider.status, BoxProvider.EMPTY)
+
+    def test_uploads_with_missing_file_failed(self):
+        bu_missing = self.get_verifying_upload(b'test', b'test')
+        bu = self.get_verifying_upload(b'test', b'test')
+        os.remove(bu_missing.file.path)
+
+        call_command('finalize_uploads', stdout=StringIO())
+
+        bu_missing.refresh_from_db()
+        bu.refresh_from_db()
+        self.assertEqual(bu_missing.status, BoxUpload.FAILED)
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+
+    def test_late_part_not_written_to_verified_file(self):
+        bu = self.get_verifying_upload(b'test', b'test')
+        # Part received late still has the upload file open
+        fd = os.open(bu.file.path, os.O_WRONLY)
+
+        call_command('finalize_uploads', stdout=StringIO())
+        try:
+            os.pwrite(fd, b'poop', 0)
+        finally:
+            os.close(fd)
+
+        bu.refresh_from_db()
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        self.assertEqual(bu.provider.file.read(), b'test')
+
+    def test_upload_claimed_by_another_worker_skipped(self):
+        bu = self.get_verifying_upload(b'test', b'test')
+        worker = finalize_uploads.Command()
+        upload = worker.claim_upload(bu.pk)
+
+        with patch.object(BoxUpload, 'hash_file') as mock_hash_file:
+            out = StringIO()
+            call_command('finalize_uploads', stdout=out)
+
+        mock_hash_file.assert_not_called()
+        self.assertIn('verified 0 uploads', out.getvalue())
+        bu.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.VERIFYING)
+
+        self.assertTrue(worker.verify_upload(upload))
+        bu.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+
+    def test_expired_claim_taken_over(self):
+        bu = self.get_verifying_upload(b'test', b'test')
+        worker = finalize_uploads.Command()
+        upload = worker.claim_upload(bu.pk)
+        BoxUpload.objects.filter(pk=bu.pk).update(
+            claimed_at=timezone.now() - timedelta(
+                minutes=settings.BOX_UPLOAD_CLAIM_EXPIRE_AFTER + 1))
+
+        call_command('finalize_uploads', stdout=StringIO())
+
+        bu.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        # Worker, which lost its claim, leaves the upload alone
+        self.assertIsNone(worker.verify_upload(upload))
+
+    def test_expired_verifying_uploads_failed(self):
+        bu = self.get_verifying_upload(b'test', b'test')
+        BoxUpload.objects.filter(pk=bu.pk).update(
+            date_modified=timezone.now() - timedelta(
+                hours=settings.BOX_UPLOAD_VERIFY_EXPIRE_AFTER + 1))
+
+        call_command('finalize_uploads', stdout=StringIO())
+
+        bu.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.FAILED)
+
+
+class MoveBoxesToBlobsCommandTestCase(TestCase):
+
+    def test_duplicated_files_stored_once(self):
+        provider1 = BoxProviderFactory()
+        provider2 = BoxProviderFactory()
+        old_path = provider1.file.path
+
+        call_command('move_boxes_to_blobs', stdout=StringIO())
+
+        provider1.refresh_from_db()
+        provider2.refresh_from_db()
+        blob_name = blob_path(
+            'sha256', hashlib.sha256(FILE_CONTENT).hexdigest())
+        self.assertTrue(provider1.file.name.startswith(blob_name[:-4]))
+        self.assertTrue(provider2.file.name.startswith(blob_name[:-4]))
+        self.assertEqual(os.stat(provider1.file.path).st_ino,
+                         os.stat(provider2.file.path).st_ino)
+        self.assertEqual(provider1.file.read(), FILE_CONTENT)
+        self.assertEqual(provider1.checksum_sha256,
+                         hashlib.sha256(FILE_CONTENT).hexdigest())
+        self.assertFalse(os.path.exists(old_path))
+
+
+class ComputeChecksumsCommandTestCase(TestCase):
+
+    def test_checksums_computed(self):
+        # Filled in before checksums were stored
+        provider = BoxProviderFactory(
+            checksum_md5='', checksum_sha1='', checksum_sha256='')
+
+        call_command('compute_checksums', stdout=StringIO())
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.checksums, {
+            'md5': hashlib.md5(FILE_CONTENT).hexdigest(),
+            'sha1': hashlib.sha1(FILE_CONTENT).hexdigest(),
+            'sha256': hashlib.sha256(FILE_CONTENT).hexdigest(),
+        })
+
+    def test_corrupted_files_reported(self):
+        provider = BoxProviderFactory(
+            checksum_md5='', checksum_sha1='', checksum_sha256='')
+        with open(provider.file.path, 'wb') as f:
+            f.write(b'poop')
+
+        stderr = StringIO()
+        call_command('compute_checksums', stdout=StringIO(), stderr=stderr)
+
+        provider.refresh_from_db()
+        self.assertIn(provider.tag, stderr.getvalue())
+        self.assertEqual(provider.checksum_sha256, '')
+
+
+class RollupPullsCommandTestCase(TestCase):
+
+    def test_pulls_rolled_up_by_day(self):
+        provider = BoxProviderFactory()
+        today = timezone.now()
+        yesterday = today - timedelta(days=1)
+        BoxDailyPulls.objects.create(
+            provider=provider, date=yesterday.date(), pulls=5)
+        BoxPull.objects.create(
+            provider=provider, date_created=yesterday, pulls=2)
+        BoxPull.objects.create(provider=provider, date_created=today, pulls=1)
+        BoxPull.objects.create(provider=provider, date_created=today, pulls=3)
+
+        call_command('rollup_pulls', stdout=StringIO())
+
+        self.assertEqual(
+            list(provider.daily_pulls.values_list('date', 'pulls')),
+            [(today.date(), 4), (yesterday.date(), 7)]
+        )
+        self.assertFalse(BoxPull.objects.exists())
+
+    @patch.object(rollup_pulls.Command, 'batch_size', 2)
+    def test_pulls_rolled_up_in_batches(self):
+        provider = BoxProviderFactory()
+        for _ in range(5):
+            BoxPull.objects.create(provider=provider, pulls=1)
+
+        out = StringIO()
+        call_command('rollup_pulls', stdout=out)
+
+        self.assertIn('rolled up 5 pulls records', out.getvalue())
+        self.assertEqual(provider.daily_pulls.get().pulls, 5)
+        self.assertFalse(BoxPull.objects.exists())
+
+    def test_pulls_committed_late_kept(self):
+        provider = BoxProviderFactory()
+        BoxPull.objects.create(provider=provider, pulls=1)
+        late_pull = BoxPull.objects.create(provider=provider, pulls=2)
+        BoxPull.objects.create(provider=provider, pulls=1)
+        # Pull with lower pk, which isn't committed yet
+        late_pull.delete()
+        add_daily_pulls = rollup_pulls.Command.add_daily_pulls
+
+        def add_daily_pulls_with_new_pull(command, row):
+            BoxPull.objects.create(
+                pk=late_pull.pk, provider=provider, pulls=2)
+            add_daily_pulls(command, row)
+
+        with patch.object(rollup_pulls.Command, 'add_daily_pulls',
+                          add_daily_pulls_with_new_pull):
+            call_command('rollup_pulls', stdout=StringIO())
+
+        self.assertEqual(provider.daily_pulls.get().pulls, 2)
+        self.assertEqual(
+            list(BoxPull.objects.values_list('pulls', flat=True)), [2])
+
+
+class ReconcilePullsCommandTestCase(TestCase):
+
+    def test_total_pulls_reconciled(self):
+        provider1 = BoxProviderFactory(provider='virtualbox', pulls=3)
+        BoxProviderFactory(
+            version=provider1.version, provider='vmware', pulls=4)
+        provider2 = BoxProviderFactory(pulls=0)
+        Box.objects.filter(pk=provider2.box.pk).update(total_pulls=2)
+
+        out = StringIO()
+        call_command('reconcile_pulls', stdout=out)
+
+        self.assertIn('reconciled pulls of 2 boxes', out.getvalue())
+        self.assertEqual(
+            Box.objects.get(pk=provider1.box.pk).total_pulls, 7)
+        self.assertEqual(
+            Box.objects.get(pk=provider2.box.pk).total_pulls, 0)
+
+
+@override_settings(BOX_PULLS_FROM_ACCESS_LOG=True)
+class IngestAccessLogCommandTestCase(TestCase):
+    LOG_LINE = '127.0.0.1 - - [18/Oct/2017:10:00:00 +0000] "{method} {path} ' \
+               'HTTP/1.1" {status} 4 "-" "Vagrant/1.9.3"\n'
+
+    def setUp(self):
+        fd, self.log_path = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, self.log_path)
+
+    def write_log(self, *lines, mode='a'):
+        with open(self.log_path, mode) as f:
+            f.write(''.join(lines))
+
+    def get_line(self, path, method='GET', status=200):
+        return self.LOG_LINE.format(method=method, path=path, status=status)
+
+    def ingest(self):
+        call_command('ingest_access_log', path=self.log_path,
+                     stdout=StringIO())
+
+    def test_downloads_counted(self):
+        provider = BoxProviderFactory(pulls=0)
+        other_provider = BoxProviderFactory(pulls=0)
+        self.write_log(
+            self.get_line(provider.download_url),
+            self.get_line(provider.download_url + '?auth_token=secret'),
+            self.get_line('/protected_media/' + provider.file.name),
+            self.get_line('/secure-downloads/{}/{}?md5=hash&expires=1'.format(
+                provider.pk, provider.file.name)),
+            self.get_line(other_provider.download_url, method='HEAD'),
+            self.get_line(other_provider.download_url, status=404),
+            self.get_line('/api/v1/boxes/'),
+        )
+
+        self.ingest()
+
+        provider.refresh_from_db()
+        other_provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 4)
+        self.assertEqual(other_provider.pulls, 0)
+        pull = BoxPull.objects.get()
+        self.assertEqual(pull.pulls, 4)
+        self.assertEqual(pull.date_created.date(), date(2017, 10, 18))
+
+    @override_settings(BOX_PULLS_FROM_ACCESS_LOG=False)
+    def test_pulls_counted_on_download_not_counted_again(self):
+        provider = BoxProviderFactory(pulls=0)
+        self.write_log(self.get_line(provider.download_url))
+
+        self.ingest()
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 0)
+
+    def test_lines_counted_once(self):
+        provider = BoxProviderFactory(pulls=0)
+        line = self.get_line(provider.download_url)
+        self.write_log(line, line[:10])
+
+        self.ingest()
+        # Line which was being written is finished
+        self.write_log(line[10:])
+        self.ingest()
+        self.ingest()
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 2)
+
+    def test_line_longer_than_batch_skipped(self):
+        provider = BoxProviderFactory(pulls=0)
+        line = self.get_line(provider.download_url)
+        self.write_log(line, 'x' * 100 + '\n', line, 'x' * 100)
+
+        call_command('ingest_access_log', path=self.log_path,
+                     batch_size=len(line) + 10, stdout=StringIO())
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 2)
+        # Long line, which is still being written, is left for later
+        position = AccessLogPosition.objects.get()
+        self.assertEqual(position.offset, 2 * len(line) + 101)
+
+    @override_settings(TIME_ZONE='Europe/Kiev')
+    def test_pulls_rolled_up_by_local_date(self):
+        provider = BoxProviderFactory(pulls=0)
+        line = self.get_line(provider.download_url)
+        # 23:30 and 00:30 of the next day in Kiev
+        self.write_log(line.replace('10:00:00', '20:30:00'),
+                       line.replace('10:00:00', '21:30:00'))
+
+        self.ingest()
+        call_command('rollup_pulls', stdout=StringIO())
+
+        self.assertEqual(
+            list(provider.daily_pulls.values_list('date', 'pulls')),
+            [(date(2017, 10, 19), 1), (date(2017, 10, 18), 1)]
+        )
+
+    def test_rotated_log_counted(self):
+        provider = BoxProviderFactory(pulls=0)
+        line = self.get_line(provider.download_url)
+        self.write_log(line)
+        self.ingest()
+
+        self.write_log(line)
+        os.rename(self.log_path, self.log_path + '.1')
+        self.addCleanup(os.remove, self.log_path + '.1')
+        self.write_log(line, mode='w')
+        self.ingest()
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 3)
@@ -1,14 +1,22 @@
-from io import StringIO
+import errno
+import hashlib
+import os
+from io import BytesIO
 from unittest.mock import patch
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
-from apps.boxes.models import Box, BoxMember, BoxUpload, BoxProvider
-from apps.factories import StaffFactory, BoxFactory, UserFactory, BoxProviderFactory, BoxUploadFactory
+from apps.boxes.models import (
+    Box, BoxMember, BoxUpload, BoxProvider, BoxVersion, blob_path)
+from apps.boxes.utils import (
+    PARALLEL_HASH_MIN_SIZE, RunningHashRegistry, running_hashes)
+from apps.factories import (
+    StaffFactory, BoxFactory, UserFactory, BoxProviderFactory,
+    BoxUploadFactory, BoxVersionFactory)
 
 
 class BoxModelTestCase(TestCase):
@@ -121,6 +129,114 @@ class BoxModelTestCase(TestCase):
             [b2, b3, b4, b5]
         )
 
+    def test_get_boxes_for_authenticated_without_distinct(self):
+        user = UserFactory()
+        box = BoxFactory(visibility=Box.PUBLIC, owner=user)
+        box.share_with(user, BoxMember.PERM_R)
+        box.share_with(UserFactory(), BoxMember.PERM_R)
+
+        boxes = Box.objects.for_user(user).annotate_pulls()
+
+        self.assertEqual(list(boxes), [box])
+        # Membership is checked by a subquery, not by a join
+        sql = str(boxes.query).upper()
+        self.assertIn('IN (SELECT', sql)
+        self.assertNotIn('DISTINCT', sql)
+        self.assertNotIn('GROUP BY', sql)
+        self.assertNotIn('JOIN "BOXES_BOXMEMBER"', sql)
+
+
+class BoxVersionTestCase(TestCase):
+
+    def create_versions(self, *versions):
+        box = BoxFactory()
+        for version in versions:
+            BoxVersionFactory(box=box, version=version)
+        return box.versions.all()
+
+    def test_version_components_saved(self):
+        version = BoxVersionFactory(version='1.10.3')
+        version.refresh_from_db()
+
+        self.assertEqual(
+            (version.version_major, version.version_minor,
+             version.version_patch),
+            (1, 10, 3)
+        )
+
+    def test_parse_version(self):
+        self.assertEqual(BoxVersion.parse_version('2.7'), (2, 7, 0))
+        with self.assertRaises(ValueError):
+            BoxVersion.parse_version('2.7-beta')
+        with self.assertRaises(ValueError):
+            BoxVersion.parse_version('1.99999999999')
+
+    def test_legacy_versions_saved(self):
+        version = BoxVersionFactory(version='1.99999999999')
+        legacy_version = BoxVersionFactory(version='1.2-beta')
+
+        version.refresh_from_db()
+        legacy_version.refresh_from_db()
+        self.assertEqual(
+            (version.version_major, version.version_minor,
+             version.version_patch),
+            (1, BoxVersion.VERSION_COMPONENT_MAX, 0)
+        )
+        self.assertEqual(
+            (legacy_version.version_major, legacy_version.version_minor,
+             legacy_version.version_patch),
+            (0, 0, 0)
+        )
+
+    def test_order_by_version(self):
+        versions = self.create_versions(
+            '1.9.0', '1.10.0', '0.10.2', '1.9.10', '1.9')
+
+        self.assertEqual(
+            [v.version for v in versions.order_by_version()],
+            ['1.10.0', '1.9.10', '1.9.0', '1.9', '0.10.2']
+        )
+
+    def test_filter_version(self):
+        versions = self.create_versions('1.9.0', '1.10.0', '0.10.2', '1.9.10')
+
+        def filter_version(lookup, version):
+            return sorted(v.version for v in
+                          versions.filter_version(lookup, version))
+
+        self.assertEqual(filter_version('gt', '1.9.0'), ['1.10.0', '1.9.10'])
+        self.assertEqual(filter_version('gte', '1.9.0'),
+                         ['1.10.0', '1.9.0', '1.9.10'])
+        self.assertEqual(filter_version('lt', '1.9.10'), ['0.10.2', '1.9.0'])
+        self.assertEqual(filter_version('lte', '1.9'), ['0.10.2', '1.9.0'])
+        self.assertEqual(
+            sorted(v.version for v in versions.newer_than('1.9.9')),
+            ['1.10.0', '1.9.10']
+        )
+
+
+    def test_filter_constraint(self):
+        versions = self.create_versions(
+            '1.9.0', '1.10.0', '2.0.0', '2.1.4', '2.2.0', '3.0.0')
+
+        def filter_constraint(constraint):
+            return sorted(v.version for v in
+                          versions.filter_constraint(constraint))
+
+        self.assertEqual(filter_constraint('>= 2.1, < 3.0'),
+                         ['2.1.4', '2.2.0'])
+        self.assertEqual(filter_constraint('~> 2.0'),
+                         ['2.0.0', '2.1.4', '2.2.0'])
+        self.assertEqual(filter_constraint('~> 2.1.0'), ['2.1.4'])
+        self.assertEqual(filter_constraint('1.10'), ['1.10.0'])
+        self.assertEqual(filter_constraint('= 1.10.0'), ['1.10.0'])
+        self.assertEqual(filter_constraint('!= 2.0.0, < 2.1'),
+                         ['1.10.0', '1.9.0'])
+        with self.assertRaises(ValueError):
+            filter_constraint('>> 2.0')
+        with self.assertRaises(ValueError):
+            filter_constraint('>= 2.x')
+
 
 class BoxUploadTestCase(TestCase):
 
@@ -138,13 +254,20 @@ class BoxUploadTestCase(TestCase):
         with self.assertRaises(AssertionError):
             bu.append_chunk('chunk')
 
+    def test_space_reserved_by_active_uploads(self):
+        BoxUploadFactory(file_size=100, offset=40)
+        BoxUploadFactory(file_size=100, preallocated=True)
+        BoxUploadFactory(file_size=100, status=BoxUpload.COMPLETED)
+
+        self.assertEqual(BoxUpload.objects.active().reserved_space(), 60)
+
     def test_box_provider_detail_filled_in_on_upload_completion(self):
         content = b'test'
         bu = BoxUploadFactory(
             file_content=content,
             provider__date_updated=timezone.now() - timedelta(hours=1),
         )
-        f = StringIO(content.decode('utf8'))
+        f = BytesIO(content)
         f.size = 4
         f.name = 'test.box'
         old_date_updated = bu.provider.date_updated
@@ -171,3 +294,215 @@ class BoxUploadTestCase(TestCase):
             bu.provider.version.box.date_updated,
             bu.provider.date_updated
         )
+
+    def get_chunk(self, content):
+        f = BytesIO(content)
+        f.size = len(content)
+        f.name = 'test.box'
+        return f
+
+    def test_checksum_computed_from_chunks(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        with patch('apps.boxes.utils.RunningHash.catch_up') as mock_catch_up:
+            bu.append_chunk(self.get_chunk(content[:5]))
+            bu.append_chunk(self.get_chunk(content[5:]))
+
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        mock_catch_up.assert_called_once_with(bu.file.path, len(content))
+        # Completed upload hash is removed from the registry
+        self.assertEqual(running_hashes.get(bu.pk).offset, 0)
+
+    def test_all_checksums_stored_on_provider(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content))
+
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.provider.checksums, {
+            'md5': hashlib.md5(content).hexdigest(),
+            'sha1': hashlib.sha1(content).hexdigest(),
+            'sha256': hashlib.sha256(content).hexdigest(),
+        })
+
+    def test_all_checksums_of_large_chunks_stored_on_provider(self):
+        content = os.urandom(PARALLEL_HASH_MIN_SIZE * 3)
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content),
+                        blocksize=PARALLEL_HASH_MIN_SIZE)
+
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        self.assertEqual(bu.provider.checksums, {
+            'md5': hashlib.md5(content).hexdigest(),
+            'sha1': hashlib.sha1(content).hexdigest(),
+            'sha256': hashlib.sha256(content).hexdigest(),
+        })
+
+    def test_chunk_not_written_to_completed_upload(self):
+        content = b'test'
+        bu = BoxUploadFactory(file_content=content)
+        stale_bu = BoxUpload.objects.get(pk=bu.pk)
+        bu.append_chunk(self.get_chunk(content))
+
+        with self.assertRaises(AssertionError):
+            stale_bu.append_chunk(self.get_chunk(b'poop'))
+
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.provider.file.read(), content)
+
+    def test_truncated_chunk_not_saved(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+        bu.append_chunk(self.get_chunk(content[:5]))
+        chunk = self.get_chunk(b'poop')
+        chunk.size = len(content) - 5
+
+        with self.assertRaises(AssertionError):
+            bu.append_chunk(chunk)
+
+        bu.refresh_from_db()
+        self.assertEqual(bu.offset, 5)
+        self.assertEqual(bu.status, BoxUpload.IN_PROGRESS)
+
+        bu.append_chunk(self.get_chunk(content[5:]))
+        self.assertEqual(bu.status, BoxUpload.VERIFYING)
+        bu.finalize()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+
+    def test_checksum_of_chunks_handled_by_another_process(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content[:4]))
+        # Second chunk is received by another process,
+        # which has its own registry of hashes
+        with patch('apps.boxes.models.running_hashes',
+                   RunningHashRegistry()):
+            bu.append_chunk(self.get_chunk(content[4:8]))
+        # Hash of the first process missed the second chunk,
+        # so it isn't fed with the rest
+        bu.append_chunk(self.get_chunk(content[8:]))
+
+        self.assertEqual(running_hashes.get(bu.pk).offset, 0)
+        self.assertEqual(bu.status, BoxUpload.VERIFYING)
+        bu.finalize()
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        self.assertEqual(bu.provider.checksum_sha256,
+                         hashlib.sha256(content).hexdigest())
+
+    def test_checksum_caught_up_with_missed_chunks(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content[:5]))
+        # Next chunk is handled by another process
+        running_hashes.discard(bu.pk)
+        bu.append_chunk(self.get_chunk(content[5:]))
+
+        # File has to be read, so it's verified in background
+        self.assertEqual(bu.status, BoxUpload.VERIFYING)
+        bu.finalize()
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+
+    def test_checksum_mismatch_not_accepted(self):
+        bu = BoxUploadFactory(file_content=b'test')
+
+        with self.assertRaises(AssertionError):
+            bu.append_chunk(self.get_chunk(b'poop'))
+        self.assertEqual(bu.status, BoxUpload.FAILED)
+
+    def test_completed_upload_linked_into_provider_storage(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content))
+
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.provider.file.read(), content)
+        self.assertEqual(os.stat(bu.provider.file.path).st_ino,
+                         os.stat(bu.file.path).st_ino)
+
+    @patch('apps.boxes.utils.os.link')
+    def test_completed_upload_copied_when_link_not_possible(self, mock_link):
+        mock_link.side_effect = OSError(errno.EXDEV, 'Invalid cross-device link')
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content))
+
+        bu.provider.refresh_from_db()
+        self.assertEqual(bu.provider.file.read(), content)
+        self.assertNotEqual(os.stat(bu.provider.file.path).st_ino,
+                            os.stat(bu.file.path).st_ino)
+
+    def test_chunk_streamed_with_buffer_smaller_than_chunk(self):
+        content = b'test content'
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content[:5]), blocksize=2)
+        bu.append_chunk(self.get_chunk(content[5:]), blocksize=3)
+
+        self.assertEqual(bu.status, BoxUpload.COMPLETED)
+        self.assertEqual(bu.offset, len(content))
+        self.assertEqual(bu.file.read(), content)
+
+    def test_chunk_exceeding_file_size_not_accepted(self):
+        bu = BoxUploadFactory(file_content=b'test')
+
+        with self.assertRaises(AssertionError):
+            bu.append_chunk(self.get_chunk(b'test content'))
+        self.assertEqual(bu.offset, 0)
+
+    @override_settings(BOX_STORAGE_CONTENT_ADDRESSED=True)
+    def test_same_file_stored_once_in_content_addressed_storage(self):
+        content = b'test content'
+        bu1 = BoxUploadFactory(file_content=content)
+        bu2 = BoxUploadFactory(file_content=content)
+
+        bu1.append_chunk(self.get_chunk(content))
+        bu2.append_chunk(self.get_chunk(content))
+
+        blob_name = blob_path('sha256', hashlib.sha256(content).hexdigest())
+        self.assertTrue(bu1.provider.file.name.startswith(blob_name[:-4]))
+        self.assertTrue(bu2.provider.file.name.startswith(blob_name[:-4]))
+        # Providers have own names linked to the same data
+        self.assertNotEqual(bu1.provider.file.name, bu2.provider.file.name)
+        self.assertEqual(os.stat(bu1.provider.file.path).st_ino,
+                         os.stat(bu2.provider.file.path).st_ino)
+        self.assertEqual(bu2.provider.file.read(), content)
+
+    @override_settings(BOX_STORAGE_CONTENT_ADDRESSED=True)
+    def test_blobs_named_by_computed_sha256(self):
+        content = b'test content'
+        bu = BoxUploadFactory(
+            file_content=content, checksum_type=BoxProvider.MD5,
+            checksum=hashlib.md5(content).hexdigest())
+
+        bu.append_chunk(self.get_chunk(content))
+
+        blob_name = blob_path('sha256', hashlib.sha256(content).hexdigest())
+        self.assertTrue(bu.provider.file.name.startswith(blob_name[:-4]))
+
+    @override_settings(BOX_STORAGE_CONTENT_ADDRESSED=True)
+    def test_blob_not_reused_when_it_does_not_match(self):
+        content = b'test content'
+        sha256 = hashlib.sha256(content).hexdigest()
+        blob_name = blob_path('sha256', sha256)
+        other = BoxProviderFactory(file_size=len(content) + 1,
+                                   checksum_sha256=sha256)
+        BoxProvider.objects.filter(pk=other.pk).update(file=blob_name)
+        path = os.path.join(settings.PROTECTED_MEDIA_ROOT, blob_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'other content')
+        bu = BoxUploadFactory(file_content=content)
+
+        bu.append_chunk(self.get_chunk(content))
+
+        self.assertNotEqual(bu.provider.file.name, blob_name)
+        self.assertEqual(bu.provider.file.read(), content)
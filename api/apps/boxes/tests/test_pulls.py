@@ -0,0 +1,73 @@
+from unittest.mock import patch
+
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from apps.boxes.models import BoxPull
+from apps.boxes.pulls import PullCounter
+from apps.factories import BoxFactory, BoxProviderFactory
+
+
+class PullCounterTestCase(TestCase):
+
+    def test_pulls_saved_on_flush(self):
+        provider1 = BoxProviderFactory(pulls=0)
+        provider2 = BoxProviderFactory(pulls=5)
+        counter = PullCounter()
+
+        counter.add(provider1.pk)
+        counter.add(provider1.pk)
+        counter.add(provider2.pk)
+
+        provider1.refresh_from_db()
+        self.assertEqual(provider1.pulls, 0)
+
+        counter.flush()
+        provider1.refresh_from_db()
+        provider2.refresh_from_db()
+        self.assertEqual(provider1.pulls, 2)
+        self.assertEqual(provider2.pulls, 6)
+        self.assertEqual(
+            set(BoxPull.objects.values_list('provider_id', 'pulls')),
+            {(provider1.pk, 2), (provider2.pk, 1)}
+        )
+
+    def test_box_total_pulls_updated_on_flush(self):
+        box = BoxFactory()
+        provider1 = BoxProviderFactory(version__box=box, pulls=0)
+        provider2 = BoxProviderFactory(version__box=box, pulls=0)
+        other_provider = BoxProviderFactory(pulls=0)
+        counter = PullCounter()
+
+        counter.add(provider1.pk, 2)
+        counter.add(provider2.pk)
+        counter.add(other_provider.pk)
+        counter.flush()
+
+        box.refresh_from_db()
+        other_provider.box.refresh_from_db()
+        self.assertEqual(box.total_pulls, 3)
+        self.assertEqual(other_provider.box.total_pulls, 1)
+
+    @override_settings(BOX_PULLS_FLUSH_INTERVAL=0)
+    def test_pulls_saved_right_away_without_interval(self):
+        provider = BoxProviderFactory(pulls=0)
+        counter = PullCounter()
+
+        counter.add(provider.pk)
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 1)
+
+    def test_pulls_not_lost_on_database_error(self):
+        provider = BoxProviderFactory(pulls=0)
+        counter = PullCounter()
+        counter.add(provider.pk)
+
+        with patch('django.db.models.QuerySet.update',
+                   side_effect=DatabaseError):
+            counter.flush()
+        counter.flush()
+
+        provider.refresh_from_db()
+        self.assertEqual(provider.pulls, 1)
@@ -1,7 +1,14 @@
-from django.test import TestCase
+import json
+import os
+from io import BytesIO
 
-from apps.boxes.models import Box, BoxVersion
-from apps.factories import BoxFactory, BoxVersionFactory, BoxProviderFactory
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from apps.boxes.metadata import create_metadata
+from apps.boxes.models import Box, BoxMetadata, BoxProvider, BoxVersion
+from apps.factories import (
+    BoxFactory, BoxVersionFactory, BoxProviderFactory, BoxUploadFactory)
 
 
 class BoxVersionDateUpdatedHandlerTestCase(TestCase):
@@ -27,3 +34,119 @@ class BoxProviderDateUpdatedHandlerTestCase(TestCase):
         updated_box = Box.objects.get(pk=box.pk)
         self.assertEqual(updated_version.date_updated, provider.date_updated)
         self.assertEqual(updated_box.date_updated, provider.date_updated)
+
+
+@override_settings(BOX_STORAGE_CONTENT_ADDRESSED=True)
+class BoxProviderDeleteHandlerTestCase(TransactionTestCase):
+
+    def upload(self, content):
+        bu = BoxUploadFactory(file_content=content)
+        f = BytesIO(content)
+        f.size = len(content)
+        f.name = 'test.box'
+        bu.append_chunk(f)
+        bu.provider.refresh_from_db()
+        return bu.provider
+
+    def test_shared_file_deleted_with_last_provider(self):
+        provider1 = self.upload(b'test')
+        provider2 = self.upload(b'test')
+        # Files stored before blobs were linked could be shared by name
+        BoxProvider.objects.filter(pk=provider2.pk).update(
+            file=provider1.file.name)
+        provider2.refresh_from_db()
+        path = provider1.file.path
+
+        provider1.delete()
+        self.assertTrue(os.path.exists(path))
+
+        provider2.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_linked_blob_kept_with_other_provider(self):
+        provider1 = self.upload(b'test')
+        provider2 = self.upload(b'test')
+        self.assertNotEqual(provider1.file.name, provider2.file.name)
+
+        provider1.delete()
+
+        self.assertFalse(os.path.exists(provider1.file.path))
+        with open(provider2.file.path, 'rb') as f:
+            self.assertEqual(f.read(), b'test')
+
+
+class BoxProviderPullsDeleteHandlerTestCase(TestCase):
+
+    def test_box_total_pulls_decreased(self):
+        provider = BoxProviderFactory(pulls=2)
+        Box.objects.filter(pk=provider.box.pk).update(total_pulls=5)
+
+        provider.delete()
+
+        self.assertEqual(Box.objects.get(pk=provider.box.pk).total_pulls, 3)
+
+
+class BoxMetadataHandlerTestCase(TestCase):
+
+    def test_metadata_rebuilt_on_provider_change(self):
+        provider = BoxProviderFactory()
+        create_metadata(provider.box)
+
+        provider.provider = 'changed'
+        provider.save()
+
+        metadata = json.loads(
+            BoxMetadata.objects.get(box=provider.box).document)
+        self.assertEqual(metadata['versions'][0]['providers'][0]['name'],
+                         'changed')
+
+    def test_box_with_metadata_deleted(self):
+        provider = BoxProviderFactory()
+        box = provider.box
+        create_metadata(box)
+
+        box.delete()
+
+        self.assertFalse(BoxMetadata.objects.exists())
+
+
+@override_settings(BOX_METADATA_BASE_URL='http://example.com')
+class BoxStaticMetadataHandlerTestCase(TransactionTestCase):
+
+    def get_static_path(self, box):
+        return os.path.join(settings.BOX_METADATA_ROOT, box.owner.username,
+                            '{}.json'.format(box.name))
+
+    def test_static_metadata_written_for_public_box(self):
+        provider = BoxProviderFactory(version__box__visibility=Box.PUBLIC)
+        path = self.get_static_path(provider.box)
+
+        with open(path) as f:
+            metadata = json.load(f)
+        self.assertEqual(metadata['name'], provider.box.tag)
+        self.assertTrue(metadata['versions'][0]['providers'][0]['url']
+                        .startswith('http://example.com/downloads/'))
+
+    def test_static_metadata_not_written_for_private_box(self):
+        provider = BoxProviderFactory(version__box__visibility=Box.PRIVATE)
+
+        self.assertFalse(os.path.exists(self.get_static_path(provider.box)))
+
+    def test_static_metadata_deleted_when_box_made_private(self):
+        box = BoxFactory(visibility=Box.PUBLIC)
+        path = self.get_static_path(box)
+        self.assertTrue(os.path.exists(path))
+
+        box.visibility = Box.PRIVATE
+        box.save()
+
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(BoxMetadata.objects.filter(box=box).exists())
+
+    def test_static_metadata_deleted_with_box(self):
+        box = BoxProviderFactory(version__box__visibility=Box.PUBLIC).box
+        path = self.get_static_path(box)
+
+        box.delete()
+
+        self.assertFalse(os.path.exists(path))
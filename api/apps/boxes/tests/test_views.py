@@ -1,11 +1,14 @@
+from django.core.signals import request_finished
+from django.db import close_old_connections
+from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import (
     APITestCase, APIRequestFactory, force_authenticate)
 
-from apps.boxes.models import BoxProvider
+from apps.boxes.models import Box, BoxMember, BoxProvider
+from apps.boxes.pulls import pull_counter
 from apps.boxes.views import DownloadBoxView
-from apps.factories import (
-    BoxProviderFactory)
+from apps.factories import BoxProviderFactory, UserFactory, FILE_CONTENT
 
 
 class DownloadBoxViewTestCase(APITestCase):
@@ -28,6 +31,138 @@ class DownloadBoxViewTestCase(APITestCase):
 
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+        pull_counter.flush()
         updated_provider = BoxProvider.objects.get(pk=provider.pk)
         self.assertEqual(provider.pulls + 1, updated_provider.pulls)
         self.assertEqual(provider.date_modified, updated_provider.date_modified)
+
+    @override_settings(BOX_PULLS_FROM_ACCESS_LOG=True)
+    def test_pulls_not_counted_when_counted_from_access_log(self):
+        provider = BoxProviderFactory()
+
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=provider.owner)
+        response = self.view(
+            request,
+            username=provider.owner.username,
+            box_name=provider.box.name,
+            version=provider.version.version,
+            provider=provider.provider)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        pull_counter.flush()
+        updated_provider = BoxProvider.objects.get(pk=provider.pk)
+        self.assertEqual(provider.pulls, updated_provider.pulls)
+
+    def test_box_resolved_with_single_query(self):
+        user = UserFactory()
+        provider = BoxProviderFactory()
+        provider.box.share_with(user, BoxMember.PERM_R)
+
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=user)
+        with self.assertNumQueries(1):
+            response = self.view(
+                request,
+                username=provider.owner.username,
+                box_name=provider.box.name,
+                version=provider.version.version,
+                provider=provider.provider)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        pull_counter.flush()
+
+    def test_private_box_not_found(self):
+        provider = BoxProviderFactory(version__box__visibility=Box.PRIVATE)
+
+        request = self.factory.get('/url/')
+        force_authenticate(request, user=UserFactory())
+        response = self.view(
+            request,
+            username=provider.owner.username,
+            box_name=provider.box.name,
+            version=provider.version.version,
+            provider=provider.provider)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class DownloadBoxViewRangeTestCase(APITestCase):
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.view = DownloadBoxView.as_view({'get': 'get'})
+        self.provider = BoxProviderFactory(
+            version__box__visibility=Box.PUBLIC)
+        # Closing a response finishes the request, which would close
+        # the database connection of the test. Test client prevents it
+        # the same way
+        request_finished.disconnect(close_old_connections)
+        self.addCleanup(request_finished.connect, close_old_connections)
+
+    def tearDown(self):
+        pull_counter.flush()
+
+    def download(self, **headers):
+        request = self.factory.get('/url/', **headers)
+        return self.view(
+            request,
+            username=self.provider.owner.username,
+            box_name=self.provider.box.name,
+            version=self.provider.version.version,
+            provider=self.provider.provider)
+
+    def get_content(self, response):
+        content = b''.join(response.streaming_content)
+        response.close()
+        return content
+
+    def test_file_served_with_etag(self):
+        response = self.download()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['ETag'],
+                         '"{}"'.format(self.provider.checksum))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(FILE_CONTENT)))
+        self.assertEqual(self.get_content(response), FILE_CONTENT)
+
+    def test_not_modified(self):
+        response = self.download(
+            HTTP_IF_NONE_MATCH='"{}"'.format(self.provider.checksum))
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_range_served(self):
+        response = self.download(HTTP_RANGE='bytes=1-2')
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'],
+                         'bytes 1-2/{}'.format(len(FILE_CONTENT)))
+        self.assertEqual(response['Content-Length'], '2')
+        self.assertEqual(self.get_content(response), FILE_CONTENT[1:3])
+
+    def test_open_and_suffix_ranges_served(self):
+        response = self.download(HTTP_RANGE='bytes=2-')
+        self.assertEqual(self.get_content(response), FILE_CONTENT[2:])
+
+        response = self.download(HTTP_RANGE='bytes=-3')
+        self.assertEqual(self.get_content(response), FILE_CONTENT[-3:])
+
+    def test_unsatisfiable_range(self):
+        response = self.download(
+            HTTP_RANGE='bytes={}-'.format(len(FILE_CONTENT)))
+
+        self.assertEqual(response.status_code,
+                         status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'],
+                         'bytes */{}'.format(len(FILE_CONTENT)))
+
+    def test_range_of_changed_file_served_as_whole_file(self):
+        response = self.download(HTTP_RANGE='bytes=1-2',
+                                 HTTP_IF_RANGE='"outdated"')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.get_content(response), FILE_CONTENT)
@@ -1,18 +1,278 @@
+import base64
 import hashlib
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
 
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
 
-def get_file_hash(afile, hasher, blocksize=65536):
-    hasher = getattr(hashlib, hasher)()
 
-    if afile.closed:
-        afile.open()
-    else:
-        # In case file was already read, set the read cursor
-        # to the start of the file
-        afile.seek(0)
+logger = logging.getLogger(__name__)
 
-    buf = afile.read(blocksize)
-    while len(buf) > 0:
-        hasher.update(buf)
-        buf = afile.read(blocksize)
-    return hasher.hexdigest()
+# ioctl request number to clone file data on copy-on-write file systems
+# (Btrfs, XFS with reflink=1), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+
+CHECKSUM_TYPES = ('md5', 'sha1', 'sha256')
+
+# Data of running hashes shorter than this is hashed in place,
+# as handing it to other threads costs more than hashing it
+PARALLEL_HASH_MIN_SIZE = 64 * 1024
+
+# Threads shared by running hashes of all uploads of the process,
+# there is no use in more of them than CPUs
+_hash_executor = ThreadPoolExecutor(
+    max_workers=max(os.cpu_count() or 1, len(CHECKSUM_TYPES)))
+
+
+def _hash_file(hashers, afile, start, end, blocksize=1024 * 1024):
+    """ Feeds bytes of `afile` between `start` and `end` to all `hashers`.
+
+    File is read once, with `readinto` into two reusable buffers. While
+    one buffer is being filled, the other is hashed by worker threads,
+    one per hasher, as `hashlib` releases the GIL on large updates.
+    """
+    buffers = (bytearray(blocksize), bytearray(blocksize))
+    pending = []
+    afile.seek(start)
+
+    with ThreadPoolExecutor(max_workers=len(hashers)) as executor:
+        position = start
+        index = 0
+        while True:
+            view = memoryview(buffers[index])[:min(blocksize, end - position)]
+            read = afile.readinto(view) if len(view) else 0
+            # The other buffer can be reused, once it's hashed
+            for future in pending:
+                future.result()
+            if not read:
+                break
+            pending = [executor.submit(hasher.update, view[:read])
+                       for hasher in hashers]
+            position += read
+            index = 1 - index
+    return position
+
+
+def get_file_hashes(path, checksum_types=CHECKSUM_TYPES,
+                    blocksize=1024 * 1024):
+    """ Returns dict of hex digests of a file for each of `checksum_types`.
+
+    All digests are computed in a single read of the file.
+    """
+    hashers = OrderedDict(
+        (checksum_type, hashlib.new(checksum_type))
+        for checksum_type in checksum_types
+    )
+    with open(path, 'rb', buffering=0) as afile:
+        size = os.fstat(afile.fileno()).st_size
+        _hash_file(hashers.values(), afile, 0, size, blocksize)
+    return OrderedDict(
+        (checksum_type, hasher.hexdigest())
+        for checksum_type, hasher in hashers.items()
+    )
+
+
+def get_free_space(path):
+    """ Returns number of bytes available to unprivileged users
+    on the file system of `path`.
+    """
+    # Storage directories are created lazily,
+    # so the closest existing one is checked
+    while not os.path.exists(path):
+        path = os.path.dirname(path)
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+
+def get_secure_link_hash(path, expires, secret):
+    """ Returns hash of download link for nginx `secure_link` module.
+
+    It's computed as `secure_link_md5 "$secure_link_expires$uri secret"`.
+    """
+    digest = hashlib.md5(
+        '{}{} {}'.format(expires, path, secret).encode()).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+
+
+def _clone_or_copy_file(src_path, dst_path, blocksize=1024 * 1024):
+    with open(src_path, 'rb') as src, open(dst_path, 'xb') as dst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return
+            except OSError:
+                pass
+        shutil.copyfileobj(src, dst, blocksize)
+
+
+def link_file(storage, src_name, dst_name, max_length=None):
+    """ Makes file `src_name` of `storage` available under `dst_name`.
+
+    File is hard linked, so no data is copied. Reflink and then
+    a plain copy are used when file system doesn't support it or
+    paths are on different devices.
+    Returns the name actually used for the new file.
+    """
+    src_path = storage.path(src_name)
+    while True:
+        dst_name = storage.get_available_name(dst_name, max_length=max_length)
+        dst_path = storage.path(dst_name)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            os.link(src_path, dst_path)
+        except FileExistsError:
+            # File was created in between, try another name
+            continue
+        except OSError as e:
+            logger.info("Can't hard link {} to {} ({}), copying it"
+                        .format(src_name, dst_name, e))
+            try:
+                _clone_or_copy_file(src_path, dst_path)
+            except FileExistsError:
+                continue
+        return dst_name
+
+
+def copy_file(storage, src_name, dst_name, max_length=None):
+    """ Copies file `src_name` of `storage` to `dst_name`.
+
+    Data is shared by reflink, when file system supports it,
+    but unlike a hard link, the copy isn't changed with the original.
+    Returns the name actually used for the new file.
+    """
+    src_path = storage.path(src_name)
+    while True:
+        dst_name = storage.get_available_name(dst_name, max_length=max_length)
+        dst_path = storage.path(dst_name)
+        os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+        try:
+            _clone_or_copy_file(src_path, dst_path)
+        except FileExistsError:
+            # File was created in between, try another name
+            continue
+        return dst_name
+
+
+class FileRange:
+    """ Read only file object limited to `length` bytes from `start`.
+
+    `fileno` is exposed and the file is positioned at `start`,
+    so WSGI servers can send the range with `os.sendfile`
+    (limited by Content-Length), while others read it.
+    """
+
+    def __init__(self, afile, start, length):
+        self.file = afile
+        self.file.seek(start)
+        self._remaining = length
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self.file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class RunningHash:
+    """ Hashes of the leading bytes of a file, fed chunk by chunk.
+
+    `offset` is the number of bytes consumed so far, so the hashes
+    can only be extended with data which starts exactly at it.
+    """
+
+    def __init__(self, checksum_types=CHECKSUM_TYPES):
+        self.hashers = OrderedDict(
+            (checksum_type, hashlib.new(checksum_type))
+            for checksum_type in checksum_types
+        )
+        self.offset = 0
+
+    def update(self, data):
+        """ Feeds `data` to all hashes.
+
+        Large data is hashed in parallel on the shared thread pool,
+        as `hashlib` releases the GIL, so feeding it takes about as long
+        as the slowest hash instead of all of them together.
+        """
+        hashers = list(self.hashers.values())
+        if len(data) < PARALLEL_HASH_MIN_SIZE or len(hashers) == 1:
+            for hasher in hashers:
+                hasher.update(data)
+        else:
+            futures = [_hash_executor.submit(hasher.update, data)
+                       for hasher in hashers[1:]]
+            hashers[0].update(data)
+            for future in futures:
+                future.result()
+        self.offset += len(data)
+
+    def catch_up(self, path, offset, blocksize=1024 * 1024):
+        """ Feeds bytes of file at `path` between own offset and `offset`. """
+        if self.offset >= offset:
+            return
+
+        with open(path, 'rb', buffering=0) as afile:
+            self.offset = _hash_file(
+                self.hashers.values(), afile, self.offset, offset, blocksize)
+
+    def hexdigest(self, checksum_type):
+        return self.hashers[checksum_type].hexdigest()
+
+    def hexdigests(self):
+        return OrderedDict(
+            (checksum_type, hasher.hexdigest())
+            for checksum_type, hasher in self.hashers.items()
+        )
+
+
+class RunningHashRegistry:
+    """ Process local registry of running hashes of chunked uploads.
+
+    `hashlib` objects cannot be serialized, so a hash lives in the worker
+    process which received the chunks. Upload requests are therefore
+    routed to a single multithreaded process (see conf/nginx.conf and
+    conf/gunicorn_uploads.conf.py), which is also the limit of this
+    approach: uploads can't be spread over several processes or hosts.
+    Otherwise, when chunks of one upload are handled by different
+    processes, each hash stops at the first missed chunk and the upload
+    is verified from the file by `finalize_uploads` command.
+    Registry keeps only `maxsize` most recently used hashes.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._hashes = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            running_hash = self._hashes.pop(key, None)
+            if running_hash is None:
+                running_hash = RunningHash()
+            self._hashes[key] = running_hash
+            while len(self._hashes) > self.maxsize:
+                self._hashes.popitem(last=False)
+            return running_hash
+
+    def discard(self, key):
+        with self._lock:
+            self._hashes.pop(key, None)
+
+
+running_hashes = RunningHashRegistry()
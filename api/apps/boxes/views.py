@@ -1,13 +1,103 @@
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
 from sendfile import sendfile
 
 from apps.boxes.api_views import BoxProviderViewSet
+from apps.boxes.pulls import pull_counter
+from apps.boxes.utils import FileRange
+
+
+# Backends, which read the file in Python
+PYTHON_SENDFILE_BACKENDS = (
+    'sendfile.backends.development',
+    'sendfile.backends.simple',
+)
 
 
 class DownloadBoxView(BoxProviderViewSet):
+    range_pattern = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
 
     def get(self, request, *args, **kwargs):
         provider = self.get_object()
-        provider.pulls += 1
-        # Date modified should not be updated
-        provider.save(update_fields=['pulls'])
-        return sendfile(request, provider.file.path)
+        etag = '"{}"'.format(provider.checksum)
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH', '')
+        if if_none_match == '*' or etag in [
+                tag.strip() for tag in if_none_match.split(',')]:
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        if settings.SENDFILE_BACKEND not in PYTHON_SENDFILE_BACKENDS:
+            # Server behind X-Sendfile handles ranges itself
+            self.count_pull(provider)
+            response = sendfile(request, provider.file.path)
+            response['ETag'] = etag
+            return response
+
+        afile = open(provider.file.path, 'rb')
+        size = os.fstat(afile.fileno()).st_size
+        byte_range = self.get_range(request, etag, size)
+        if byte_range is False:
+            afile.close()
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{}'.format(size)
+            return response
+
+        if byte_range is None:
+            # Resumed downloads are counted only once
+            self.count_pull(provider)
+            response = FileResponse(afile)
+            response['Content-Length'] = size
+        else:
+            start, end = byte_range
+            if start == 0:
+                self.count_pull(provider)
+            response = FileResponse(FileRange(afile, start, end - start + 1),
+                                    status=206)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes {}-{}/{}'.format(
+                start, end, size)
+        response.block_size = 1024 * 1024
+        response['Content-Type'] = 'application/octet-stream'
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        return response
+
+    def get_range(self, request, etag, size):
+        """ Returns first and last byte positions of requested range.
+
+        Returns None, when whole file should be served,
+        and False, when range can't be satisfied.
+        """
+        header = request.META.get('HTTP_RANGE', '').strip()
+        match = self.range_pattern.match(header)
+        # Several ranges are served as a whole file
+        if not match or not (match.group('start') or match.group('end')):
+            return None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range is not None and if_range != etag:
+            return None
+
+        if not match.group('start'):
+            # Last N bytes of the file
+            suffix = int(match.group('end'))
+            if not suffix:
+                return False
+            return max(size - suffix, 0), size - 1
+
+        start = int(match.group('start'))
+        end = int(match.group('end') or size - 1)
+        if match.group('end') and end < start:
+            # Invalid range is ignored
+            return None
+        if start >= size:
+            return False
+        return start, min(end, size - 1)
+
+    def count_pull(self, provider):
+        if not settings.BOX_PULLS_FROM_ACCESS_LOG:
+            pull_counter.add(provider.pk)
@@ -134,6 +134,12 @@ class BoxProviderFactory(EmptyBoxProviderFactory):
     checksum = factory.LazyAttribute(
         lambda o: hashlib.sha256(object_file_content(o)).hexdigest())
     checksum_type = BoxProvider.SHA256
+    checksum_md5 = factory.LazyAttribute(
+        lambda o: hashlib.md5(object_file_content(o)).hexdigest())
+    checksum_sha1 = factory.LazyAttribute(
+        lambda o: hashlib.sha1(object_file_content(o)).hexdigest())
+    checksum_sha256 = factory.LazyAttribute(
+        lambda o: hashlib.sha256(object_file_content(o)).hexdigest())
     status = models.BoxProvider.FILLED_IN
 
 
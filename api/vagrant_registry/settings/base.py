@@ -174,6 +174,49 @@ REST_FRAMEWORK = {
 SENDFILE_BACKEND = 'sendfile.backends.development'
 
 BOX_UPLOAD_EXPIRE_AFTER = 24    # hours
+# Uploads, which weren't verified in this time by `finalize_uploads`
+# command, are failed, so they don't stay verifying forever
+BOX_UPLOAD_VERIFY_EXPIRE_AFTER = 24     # hours
+# Verifying upload is taken by one worker at a time. Other workers take it
+# over after this time, in case the first one died while verifying it.
+BOX_UPLOAD_CLAIM_EXPIRE_AFTER = 60      # minutes
+
+# Sizes of parts of multipart uploads, all parts except the last one
+# are of the same size. Maximum is limited by client_max_body_size of nginx.
+BOX_UPLOAD_MIN_PART_SIZE = 1024 * 1024              # bytes
+BOX_UPLOAD_MAX_PART_SIZE = 100 * 1024 * 1024        # bytes
+
+# Allocate disk space for the whole box file when upload is initiated
+BOX_UPLOAD_PREALLOCATE = True
+
+# Store boxes files by their checksum, so the same file
+# uploaded for several providers is stored only once
+BOX_STORAGE_CONTENT_ADDRESSED = False
+
+# Boxes pulls are counted in memory and saved in batches
+# at most after this many seconds, 0 saves every pull right away
+BOX_PULLS_FLUSH_INTERVAL = 10   # seconds
+
+# Count boxes pulls from nginx access log with `ingest_access_log`
+# command instead of counting them on download
+BOX_PULLS_FROM_ACCESS_LOG = False
+NGINX_ACCESS_LOG = '/logs/nginx/nginx.access.log'
+
+# Boxes metadata links to downloads signed for nginx `secure_link`
+# module, so boxes files are served by nginx without Django.
+# Signed downloads are disabled without the secret. Their pulls are
+# counted only from nginx access log, so BOX_PULLS_FROM_ACCESS_LOG has
+# to be enabled along with the secret (checked by `check` command).
+SECURE_DOWNLOADS_URL = '/secure-downloads/'
+SECURE_DOWNLOADS_SECRET = ''
+SECURE_DOWNLOADS_EXPIRE_AFTER = 3600    # seconds
+
+# Metadata of public boxes is written to static files served by nginx.
+# Base URL of the registry is required for download URLs in them,
+# static files are disabled without it. Requests with query parameters,
+# which limit versions, are passed to Django (see conf/nginx.conf).
+BOX_METADATA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'box_metadata')
+BOX_METADATA_BASE_URL = ''
 
 TOKEN_EXPIRE_AFTER = 24     # hours
 
@@ -247,3 +290,4 @@ if 'test' in sys.argv:
     logging.disable(logging.CRITICAL)
     MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'media_test')
     PROTECTED_MEDIA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'protected_media_test')
+    BOX_METADATA_ROOT = os.path.join(os.path.dirname(BASE_DIR), 'box_metadata_test')
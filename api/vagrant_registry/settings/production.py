@@ -28,6 +28,15 @@ SENDFILE_BACKEND = 'sendfile.backends.nginx'
 SENDFILE_ROOT = PROTECTED_MEDIA_ROOT
 SENDFILE_URL = PROTECTED_MEDIA_URL
 
+# Has to be the same as in nginx, see bin/start_nginx.sh
+SECURE_DOWNLOADS_SECRET = os.environ.get('SECURE_DOWNLOADS_SECRET', '')
+# Signed downloads are served by nginx, so their pulls are counted
+# from its access log by `ingest_access_log` command
+BOX_PULLS_FROM_ACCESS_LOG = bool(SECURE_DOWNLOADS_SECRET)
+
+# E.g. https://registry.example.com
+BOX_METADATA_BASE_URL = os.environ.get('BOX_METADATA_BASE_URL', '')
+
 if os.environ.get('BEHIND_HTTPS_PROXY', False) == 'true':
     # WARNING! This should be used only behind HTTPS proxy,
     # other than from the Docker image! Docker image Nginx server
@@ -70,13 +70,26 @@ box_upload_detail = boxes_api_views.BoxUploadHandlerViewSet.as_view({
     'put': 'update',
     'delete': 'destroy'
 }, **{'suffix': 'Instance'})
+box_upload_part_detail = boxes_api_views.BoxUploadHandlerViewSet.as_view({
+    'put': 'upload_part',
+}, **{'suffix': 'Instance'})
+box_pulls_list = boxes_api_views.BoxPullsViewSet.as_view({
+    'get': 'list',
+}, **{'suffix': 'List'})
 box_metadata_detail = boxes_api_views.BoxMetadataViewSet.as_view({
     'get': 'retrieve',
 }, **{'suffix': 'Instance'})
+box_resolve = boxes_api_views.BoxResolveViewSet.as_view({
+    'get': 'retrieve',
+}, **{'suffix': 'Instance'})
+box_metadata_bulk = boxes_api_views.BoxMetadataBulkViewSet.as_view({
+    'get': 'list',
+}, **{'suffix': 'List'})
 
 api_v1_urlpatterns = [
     url(r'^', include(router.urls)),
     url(r'^boxes/(?P<username>[\w.@+-]+)/$', box_list, name='box-list'),
+    url(r'^box-metadata/$', box_metadata_bulk, name='boxmetadata-bulk'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/$',
         box_detail, name='box-detail'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/members/$',
@@ -86,11 +99,18 @@ api_v1_urlpatterns = [
         box_member_detail, name='boxmember-detail'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/metadata/$',
         box_metadata_detail, name='boxmetadata-detail'),
+    url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/resolve/$',
+        box_resolve, name='box-resolve'),
+    url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/pulls/$',
+        box_pulls_list, name='boxpulls-list'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/versions/$',
         box_version_list, name='boxversion-list'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/versions/'
         r'(?P<version>\d+\.\d+\.\d+)/$',
         box_version_detail, name='boxversion-detail'),
+    url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/versions/'
+        r'(?P<version>\d+\.\d+\.\d+)/pulls/$',
+        box_pulls_list, name='boxversionpulls-list'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/versions/'
         r'(?P<version>\d+\.\d+\.\d+)/providers/$',
         box_provider_list, name='boxprovider-list'),
@@ -101,6 +121,10 @@ api_v1_urlpatterns = [
         r'(?P<version>\d+\.\d+\.\d+)/providers/(?P<provider>[\w.@+-]+)/'
         r'uploads/$',
         box_upload_list, name='boxupload-list'),
+    url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/versions/'
+        r'(?P<version>\d+\.\d+\.\d+)/providers/(?P<provider>[\w.@+-]+)/'
+        r'uploads/(?P<checksum>[^/]+)/parts/(?P<part_number>\d+)/$',
+        box_upload_part_detail, name='boxuploadpart-detail'),
     url(r'^boxes/(?P<username>[\w.@+-]+)/(?P<box_name>[\w.@+-]+)/versions/'
         r'(?P<version>\d+\.\d+\.\d+)/providers/(?P<provider>[\w.@+-]+)/'
         r'uploads/(?P<checksum>.+)/$',
@@ -0,0 +1,8 @@
+#!/usr/bin/env bash
+
+# Secret of signed box downloads is shared with Django
+# through SECURE_DOWNLOADS_SECRET environment variable
+echo "set \$secure_link_secret \"${SECURE_DOWNLOADS_SECRET}\";" \
+    > /etc/nginx/secure_link_secret.conf
+
+exec /usr/sbin/nginx -g "daemon off;"
@@ -32,7 +32,8 @@ function* uploadChunks({file, offset, tag, version, provider, upload}) {
       data: data,
       range: {
         start: loaded,
-        end: loaded + dataSize,
+        // Last byte position is inclusive
+        end: loaded + dataSize - 1,
         total: totalSize,
       }
     });
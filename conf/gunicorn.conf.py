@@ -9,3 +9,9 @@ pidfile = "/tmp/gunicorn.pid"
 # Log settings for Gunicorn, not Django
 loglevel = "info"
 errorlog = '/logs/gunicorn/gunicorn.log'
+
+
+def worker_exit(server, worker):
+    # Save pulls counted by the worker before it exits
+    from apps.boxes.pulls import pull_counter
+    pull_counter.flush()
@@ -0,0 +1,17 @@
+import multiprocessing
+
+
+# Chunks of an upload are hashed as they arrive by the process, which
+# received the previous ones (see RunningHashRegistry), so all upload
+# requests are served by a single process. Its threads write and hash
+# chunks of different uploads concurrently, as both release the GIL.
+bind = "unix:/tmp/gunicorn_uploads.sock"
+workers = 1
+worker_class = "gthread"
+threads = multiprocessing.cpu_count() * 2 + 1
+
+pidfile = "/tmp/gunicorn_uploads.pid"
+
+# Log settings for Gunicorn, not Django
+loglevel = "info"
+errorlog = '/logs/gunicorn/gunicorn_uploads.log'